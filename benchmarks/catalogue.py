@@ -0,0 +1,96 @@
+"""
+Benchmark of ToolIndex on a synthetic Galaxy catalogue of ToolShed tools, each listed in three versions, some of them
+invalid. Times deduplication the way safe_tools did it before the index (parsing both versions of every comparison)
+against building the index, which is all a login waits on, then building the search structure on the first search,
+and prefix search of the index against a substring scan of every tool.
+
+    python benchmarks/catalogue.py [tools...]
+"""
+import random
+import sys
+import tracemalloc
+from time import perf_counter
+from bioblend.galaxy.objects.wrappers import Tool
+from packaging.version import Version, InvalidVersion
+from galahad.catalogue import ToolIndex, parse_version
+from galahad.utils import strip_version
+
+WORDS = ['align', 'bam', 'bed', 'fastq', 'filter', 'trim', 'sort', 'merge', 'vcf', 'variant', 'call', 'count',
+         'genome', 'map', 'reads', 'quality', 'report', 'stats', 'convert', 'join']
+VERSIONS = ['1.0.0', '1.2.3', '2.0', '2.1.0+galaxy1', '0.9', 'abc', '3.0.1']
+QUERIES = ['a', 'al', 'align', 'fastq tr', 'variant call 12', 'zzz']
+
+
+def catalogue(size):
+    """Return a raw tools.list() of the given size, with every tool in three versions"""
+    rng, tools = random.Random(1), []
+    for i in range(size // 3 + 1):
+        base = f'toolshed.g2.bx.psu.edu/repos/devteam/{rng.choice(WORDS)}_{i}/{rng.choice(WORDS)}_{i}'
+        record = {'name': f'{rng.choice(WORDS).title()} {i}', 'description': ' '.join(rng.sample(WORDS, 4)),
+                  'panel_section_name': rng.choice(WORDS).title()}
+        tools += [Tool({**record, 'id': f'{base}/{v}', 'version': v}, gi=None) for v in rng.sample(VERSIONS, 3)]
+    return tools[:size - 1] + [Tool({'id': 'upload1', 'name': 'Upload File', 'version': '1.1.7'}, gi=None)]
+
+
+def later_version(tool_a, tool_b):
+    """GalaxyAuthWidget.later_version before the index, which parsed both versions on every call"""
+    if tool_a is None: return True
+    if tool_b is None: return False
+    try: version_b = Version(tool_b.version)
+    except InvalidVersion: return False
+    try: version_a = Version(tool_a.version)
+    except InvalidVersion: return True
+    return version_a <= version_b
+
+
+def dedupe(raw_list):
+    """GalaxyAuthWidget.safe_tools before the index"""
+    safe_list = {}
+    for galaxy_tool in raw_list:
+        if galaxy_tool.name in ['Data Fetch', 'Export datasets', 'Apply rules', 'Upload File']: continue
+        base_id = strip_version(galaxy_tool.id)
+        if later_version(safe_list.get(base_id), galaxy_tool): safe_list[base_id] = galaxy_tool
+    return list(safe_list.values())
+
+
+def scan(index, query):
+    """Search by checking every tool for each word of the query, as a filter without an index would"""
+    words = query.lower().split()
+    return [r for r in index.records if all(w in f'{r.id} {r.name} {r.description} {r.section}'.lower() for w in words)]
+
+
+def best(function, setup=lambda: None, runs=5):
+    """Return the fastest of several runs of the function, each after running setup untimed, in milliseconds"""
+    times = []
+    for _ in range(runs):
+        setup()
+        start = perf_counter()
+        function()
+        times.append((perf_counter() - start) * 1000)
+    return min(times)
+
+
+def run(size):
+    raw = catalogue(size)
+    index = ToolIndex(raw)
+    assert [t.id for t in dedupe(raw)] == [r.id for r in index.records]
+    tracemalloc.start()
+    ToolIndex(raw).build_search()
+    peak = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    tracemalloc.stop()
+
+    old = best(lambda: dedupe(raw))
+    built = best(lambda: ToolIndex(raw), parse_version.cache_clear)
+    fresh = {}
+    def rebuild(): fresh['index'] = ToolIndex(raw)
+    first = best(lambda: fresh['index'].search('align'), rebuild)
+    index.build_search()
+    print(f'{len(raw)} tools, {len(index)} after deduplication, {len(index.vocabulary)} words, {peak:.1f} MB peak:')
+    print(f'    dedupe {old:7.2f} ms    index {built:7.2f} ms    first search, building its structure {first:7.2f} ms')
+    for query in QUERIES:
+        hits, searched, scanned = len(index.search(query)), best(lambda: index.search(query), runs=20), \
+            best(lambda: scan(index, query))
+        print(f'    {query!r:18} {hits:5} hits    index {searched:7.2f} ms    scan {scanned:7.2f} ms')
+
+if __name__ == '__main__':
+    for size in [int(arg) for arg in sys.argv[1:]] or [10000]: run(size)
@@ -0,0 +1,67 @@
+"""
+Benchmark of event dispatch over a long notebook session. Each widget subscribes a login callback and, as its form
+is rebuilt three times, a history callback three times, and only the most recent widgets are kept open. Measures the
+time to dispatch each event and the memory still allocated as widgets accumulate, registering the callbacks directly
+with EventManager as galahad did before, then through galahad's subscriptions.
+
+    python benchmarks/events.py [widgets...]
+"""
+import gc
+import sys
+import tracemalloc
+from time import perf_counter
+from ipywidgets import Widget
+from nbtools import EventManager
+from galahad.events import Subscriptions
+
+
+class Dataset(Widget):
+    """Stands in for a galahad widget holding some state"""
+
+    def __init__(self):
+        Widget.__init__(self)
+        self.payload = bytearray(2000)
+        self.hits = 0
+
+    def login_callback(self, data=None):
+        self.hits += 1
+
+    def history_callback(self, data=None):
+        self.hits += 1
+
+
+def session(register, widgets, kept=20, samples=4, dispatches=20):
+    """Create the widgets, closing all but the last kept, return (widgets, dispatch ms, KB allocated) at each sample"""
+    EventManager.instance().events = {}
+    live, rows = [], []
+    gc.collect()
+    tracemalloc.start()
+    for i in range(1, widgets + 1):
+        widget = Dataset()
+        register('galaxy.login', widget.login_callback)
+        for _ in range(3): register('galaxy.history_refresh', widget.history_callback)   # Form rebuilds
+        live.append(widget)
+        if len(live) > kept: live.pop(0).close()   # Output of an earlier cell cleared
+        if i % (widgets // samples) == 0:
+            start = perf_counter()
+            for _ in range(dispatches):
+                EventManager.instance().dispatch('galaxy.history_refresh', {})
+                EventManager.instance().dispatch('galaxy.login', None)
+            rows.append((i, (perf_counter() - start) * 1000 / dispatches, tracemalloc.get_traced_memory()[0] // 1024))
+    tracemalloc.stop()
+    for widget in live: widget.close()
+    return rows
+
+
+def run(widgets):
+    print(f'{widgets} widgets, 20 kept open:')
+    def register(event, callback): EventManager.instance().register(event, callback)
+    subscribe = Subscriptions().subscribe
+    for label, subscribe in [('EventManager.register', register), ('subscriptions.subscribe', subscribe)]:
+        print(f'    {label}')
+        for i, dispatch, allocated in session(subscribe, widgets):
+            print(f'        {i:6} widgets    dispatch {dispatch:8.3f} ms    {allocated:8} KB allocated')
+
+
+if __name__ == '__main__':
+    for widgets in [int(arg) for arg in sys.argv[1:]] or [20000]: run(widgets)
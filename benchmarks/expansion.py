@@ -0,0 +1,80 @@
+"""
+Benchmark of ToolExpansion on synthetic deep and wide tool JSON: a repeat of samples, each with a section and nested
+conditionals holding inner repeats, plus Galaxy-style repeat caches. Times the first expansion, a re-expansion with
+nothing changed, and re-expansions after one conditional or repeat count changes, against expanding the same values
+from scratch, and checks that every re-expansion matches the one from scratch.
+
+    python benchmarks/expansion.py [repeat counts...]
+"""
+import copy
+import json
+import sys
+from time import perf_counter
+from galahad.expansion import ToolExpansion
+
+
+def leaf(name):
+    return {'name': name, 'type': 'select', 'value': '0', 'label': name,
+            'options': [[str(i), str(i), False] for i in range(50)]}
+
+
+def conditional(name, depth):
+    return {'name': name, 'type': 'conditional', 'test_param': {'name': 'sel', 'type': 'select', 'value': 'a'},
+            'cases': [{'value': v, 'inputs': [leaf('c1'), leaf('c2')] + ([repeat('inner', depth - 1, 2)] if depth > 1 else [])}
+                      for v in 'ab']}
+
+
+def repeat(name, depth, count):
+    inputs = [leaf('r1'), {'name': 'sec', 'type': 'section', 'title': 'S', 'inputs': [leaf('s1')]},
+              conditional('cnd', depth)] if depth > 0 else [leaf('r1')]
+    return {'name': name, 'type': 'repeat', 'title': name, 'default': 1, 'value': count, 'inputs': inputs,
+            'cache': [copy.deepcopy(inputs) for _ in range(count)]}
+
+
+def tool_json(count):
+    return {'inputs': [leaf('top'), repeat('samples', 2, count),
+                       {'name': 'adv', 'type': 'section', 'title': 'Advanced', 'inputs': [leaf('a'), conditional('mode', 2)]}]}
+
+
+def canonical(expansion):
+    groups, params = expansion
+    return json.dumps([groups, [(p['galaxy_name'], p['py_name'], p.get('value')) for p in params]], default=str)
+
+
+def best(function, setup=lambda: None, runs=5):
+    """Return the fastest of several runs of the function, each after running setup untimed, in milliseconds"""
+    times = []
+    for _ in range(runs):
+        setup()
+        start = perf_counter()
+        function()
+        times.append((perf_counter() - start) * 1000)
+    return min(times)
+
+
+def run(count):
+    changes = {     # Label -> (changed values, original values)
+        'unchanged': ({}, {}),
+        'conditional in the last sample': ({f'samples_{count - 1}_cnd_sel': 'b'}, {f'samples_{count - 1}_cnd_sel': 'a'}),
+        'top-level conditional': ({'adv_mode_sel': 'b'}, {'adv_mode_sel': 'a'}),
+        'repeat count + 1': ({'samples': count + 1}, {'samples': count}),
+    }
+    jsons = []
+    first = best(lambda: ToolExpansion(jsons[-1]).expand(), setup=lambda: jsons.append(tool_json(count)), runs=3)
+    print(f'{count} samples, {len(ToolExpansion(tool_json(count)).expand()[1])} parameters: first expansion {first:.1f} ms')
+    for label, (change, original) in changes.items():
+        engine = ToolExpansion(tool_json(count))
+        engine.expand(original)
+        incremental = best(lambda: engine.expand(change), setup=lambda: engine.expand(original))
+        scratch = best(lambda: ToolExpansion(jsons[-1]).expand(change), setup=lambda: jsons.append(tool_json(count)),
+                       runs=3)
+
+        # Check the incremental expansion against one from scratch
+        params = len(engine.expand(change)[1])
+        assert canonical(engine.expand(change)) == canonical(ToolExpansion(tool_json(count)).expand(change)), label
+        print(f'    {label:<32} {params:6} parameters    incremental {incremental:7.2f} ms    '
+              f'from scratch {scratch:7.2f} ms')
+
+
+if __name__ == '__main__':
+    for count in [int(arg) for arg in sys.argv[1:]] or [10, 50, 200]: run(count)
@@ -0,0 +1,106 @@
+"""
+Benchmark of SpecCompiler on real tool JSON, the responses of Galaxy's tools.build saved as fixtures. Compiles the
+expanded parameters without a memo (a new compiler every time), then with the memo after nothing changed, after the
+last conditional changed, and after tools.build returned fresh JSON with the same content, as every refresh does.
+
+Save fixtures from a Galaxy server, building each tool against a history whose datasets its data inputs offer:
+
+    python benchmarks/specs.py --fetch <server URL> <API key> <history ID> <tool ID>...
+
+Then benchmark every fixture in benchmarks/fixtures, or the given files:
+
+    python benchmarks/specs.py [fixture files...]
+"""
+import glob
+import json
+import os
+import sys
+from time import perf_counter
+from galahad.expansion import ToolExpansion
+from galahad.index import DatasetIndex
+from galahad.specs import SpecCompiler
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class Widget:
+    """Stands in for the GalaxyToolWidget methods SpecCompiler calls"""
+
+    def __init__(self):
+        self.index = DatasetIndex('history')
+
+    def dataset_index(self):
+        return self.index
+
+    def default_value_name(self, id, choices):
+        if not choices or not id: return id
+        display_name = self.index.name(id[0])
+        return [display_name] if display_name else id
+
+
+def fetch(url, key, history_id, tool_ids):
+    """Save the tools.build response of each tool as a fixture"""
+    from bioblend.galaxy import GalaxyInstance
+    gi = GalaxyInstance(url, key=key)
+    os.makedirs(FIXTURES, exist_ok=True)
+    for tool_id in tool_ids:
+        tool_json = gi.tools.build(tool_id=tool_id, history_id=history_id)
+        path = os.path.join(FIXTURES, f"{tool_json.get('id', tool_id).replace('/', '_')}.json")
+        with open(path, 'w') as f: json.dump(tool_json, f)
+        print(f'Saved {path}')
+
+
+def option_count(options):
+    """Return the number of select options, or of datasets offered by a data parameter"""
+    if isinstance(options, dict): return sum(len(l) for l in options.values())
+    return len(options or ())
+
+
+def best(function, setup=lambda: None, runs=20):
+    """Return the fastest of several runs of the function, each after running setup untimed, in milliseconds"""
+    times = []
+    for _ in range(runs):
+        setup()
+        start = perf_counter()
+        function()
+        times.append((perf_counter() - start) * 1000)
+    return min(times)
+
+
+def run(path):
+    with open(path) as f: serialized = f.read()
+    widget, expansion = Widget(), ToolExpansion(json.loads(serialized))
+    _, params = expansion.expand()
+    compiler = SpecCompiler()
+    compiler.compile(widget, params)
+    options = sum(option_count(p.get('options')) for p in params)
+    print(f'{os.path.basename(path)}: {len(params)} parameters, {options} options:')
+
+    no_memo = best(lambda: SpecCompiler().compile(widget, params))
+    unchanged = best(lambda: compiler.compile(widget, params))
+    line = f'    no memo {no_memo:7.2f} ms    unchanged {unchanged:7.2f} ms'
+
+    # Switch the last conditional between its first two cases, re-expanding as a form refresh does
+    tests = [p for p in params if p.get('conditional_test') and len(p.get('options') or ()) > 1]
+    if tests:
+        toggle, values = tests[-1]['py_name'], [o[1] for o in tests[-1]['options'][:2]]
+        state = {'value': values[0]}
+        def change():
+            state['value'] = values[1] if state['value'] == values[0] else values[0]
+            state['params'] = expansion.expand({toggle: state['value']})[1]
+        one_changed = best(lambda: compiler.compile(widget, state['params']), setup=change)
+        line += f'    one conditional changed {one_changed:7.2f} ms'
+
+    # tools.build returns new JSON with the same content, as does the build cache, which parses a copy
+    fresh = {}
+    def rebuild(): fresh['params'] = ToolExpansion(json.loads(serialized)).expand()[1]
+    fresh_json = best(lambda: compiler.compile(widget, fresh['params']), setup=rebuild)
+    print(f'{line}    fresh tools.build JSON {fresh_json:7.2f} ms')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--fetch']: fetch(sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5:])
+    else:
+        paths = sys.argv[1:] or sorted(glob.glob(os.path.join(FIXTURES, '*.json')))
+        if not paths: print(f'No fixtures in {FIXTURES}, save some with --fetch')
+        for path in paths: run(path)
@@ -2,7 +2,12 @@ from .authentication import GALAXY_SERVERS, GalaxyAuthWidget
 from .tool import GalaxyToolWidget, load_tool
 from .dataset import GalaxyDatasetWidget
 from .history import GalaxyHistoryWidget
+from .catalogue import tool_cache
+from .downloads import dataset_cache, download_history
+from .preview import read_dataset
 from .sessions import session
+from .polling import PollPolicy, poll_policy, poll_stats
+from .stats import stats
 from .display import display
 
 __author__ = 'Thorin Tabor'
@@ -0,0 +1,53 @@
+from bioblend.galaxy.objects.wrappers import History
+
+
+def history_id(dataset):
+    """Return the ID of the history containing the given dataset or content info, None if unknown"""
+    if dataset.wrapped.get('history_id'): return dataset.wrapped['history_id']
+    container = getattr(dataset, 'container', None)
+    return container.id if container else None
+
+
+def update_wrapper(wrapper, values):
+    """Merge freshly queried values into a bioblend wrapper without re-fetching it from Galaxy"""
+    wrapped = {**wrapper.wrapped, **values}
+    object.__setattr__(wrapper, 'wrapped', wrapped)
+    for k in wrapper.BASE_ATTRS: object.__setattr__(wrapper, k, wrapped.get(k))
+
+
+def list_histories(gi, limit=20, offset=0):
+    """Return summaries of one page of the user's histories, most recently updated first"""
+    return gi.gi.histories.get_histories(limit=limit, offset=offset, keys=['id', 'name', 'update_time'])
+
+
+def get_history(gi, history_id):
+    """Return a History wrapper without downloading the history's contents"""
+    return History(gi.gi.histories.show_history(history_id), gi=gi)
+
+
+def list_contents(gi, history_id, limit=100, offset=0, order='update_time-dsc', deleted=False, **filters):
+    """Return one page of the datasets in a history, most recently updated first, non-deleted ones by default"""
+    return gi.gi.datasets.get_datasets(history_id=history_id, limit=limit, offset=offset, deleted=deleted, order=order,
+                                       **filters)
+
+
+def content_pages(gi, history_id, key, descending=True, bound=None, page_size=100, **filters):
+    """
+    Yield pages of the datasets in a history ordered by a timestamp, each starting where the last ended
+    :param key: 'create_time' or 'update_time', the timestamp to order and bound the pages by
+    :param descending: whether to page from the latest timestamp down, rather than from the earliest up
+    :param bound: timestamp to start from, inclusive, or None to start from the latest or earliest dataset
+    :param filters: further filters passed on to list_contents
+    """
+    skip = 0    # Datasets already yielded whose timestamp equals the bound
+    while True:
+        window = {f'{key}_max' if descending else f'{key}_min': bound}
+        order = f'{key}-{"dsc" if descending else "asc"}'
+        page = list_contents(gi, history_id, limit=page_size, offset=skip, order=order, **window, **filters)
+        if page: yield page
+        if len(page) < page_size: return
+
+        # Bound the next page by the last timestamp seen, rather than an offset that changes shift
+        last = page[-1].get(key)
+        skip = sum(1 for content in page if content.get(key) == last) + (skip if last == bound else 0)
+        bound = last
@@ -1,14 +1,19 @@
-from collections import OrderedDict
-from packaging.version import Version, InvalidVersion
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Thread
+from bioblend import ConnectionError
 from bioblend.galaxy.objects import GalaxyInstance
-from nbtools import UIBuilder, ToolManager, NBTool, EventManager, DataManager, Data, NBOrigin
-from IPython.display import display
-from .dataset import GalaxyDatasetWidget
-from .history import GalaxyHistoryWidget
+from bioblend.galaxy.objects.wrappers import History, HistoryContentInfo
+from nbtools import UIBuilder, ToolManager, NBTool, EventManager, DataManager, NBOrigin
+from IPython import get_ipython
+from .api import list_histories, get_history
+from .catalogue import tool_cache
+from .index import dataset_index
 from .sessions import session
+from .stats import timed
+from .sync import HistoryPager, HistorySync
 from .tool import GalaxyTool, GalaxyUploadTool
-from .utils import GALAXY_LOGO, GALAXY_SERVERS, server_name, session_color, galaxy_url, data_icon, poll_data_and_update, \
-    skip_tool, data_name, strip_version, current_history
+from .utils import GALAXY_LOGO, GALAXY_SERVERS, server_name, session_color, galaxy_url, content_data, \
+    poll_data_and_update, strip_version, current_history, on_kernel_thread
 
 REGISTER_EVENT = """
     const target = event.target;
@@ -20,6 +25,9 @@ REGISTER_EVENT = """
 
 class GalaxyAuthWidget(UIBuilder):
     """A widget for authenticating with a Galaxy server"""
+    pager = None            # Fetches pages of the current history's contents
+    history_sync = None     # Applies incremental changes to the current history's contents
+    first_chunk = 250       # Tools in the first registration update, each update sends twice as many as the last
     login_spec = {  # The display values for building the login UI
         'name': 'Login',
         'collapse': False,
@@ -62,11 +70,13 @@ class GalaxyAuthWidget(UIBuilder):
         if session:
             for k, v in [('collapsed', True), ('name', self.session.email), ('subtitle', galaxy_url(self.session)),
                          ('display_header', False), ('display_footer', False)]: kwargs[k] = v
-            self.prepare_session()
 
         # Call the superclass constructor with the spec
         UIBuilder.__init__(self, self.login, **kwargs)
 
+        # Begin loading in the background once the widget exists to report progress
+        if session: self.prepare_session()
+
     def login(self, server, email, password):
         """Login to the Galaxy server"""
         try:
@@ -87,61 +97,106 @@ class GalaxyAuthWidget(UIBuilder):
         self.form.display_footer = False
 
     def prepare_session(self):
-        """Prepare a valid session by registering the session and tools"""
-        self.register_session()     # Register the session with the SessionList
-        self.register_tools()       # Register the modules with the ToolManager
-        self.register_history()     # Add history to the data panel
-        self.trigger_login()        # Trigger login callbacks of job and tool widgets
+        """Prepare a valid session by registering it, then loading tools and history concurrently in the background"""
+        self.register_session()     # Register the session with the SessionList, making it usable immediately
+        executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='galahad-login')
+        steps = [executor.submit(self.register_tools),      # Register the modules with the ToolManager
+                 executor.submit(self.register_history)]    # Add history to the data panel
+        executor.shutdown(wait=False)
+        Thread(target=self.finish_login, args=(steps,), daemon=True).start()
+
+    def finish_login(self, steps):
+        """Wait for the concurrent login steps, then trigger the login callbacks on the kernel's thread"""
+        wait(steps)
+        errors = [str(step.exception()) for step in steps if step.exception() is not None]
+        history_loaded = steps[1].exception() is None   # Widgets can't log in without a current history
+        on_kernel_thread(self.complete_login, errors, history_loaded)
+
+    def complete_login(self, errors, history_loaded):
+        """Trigger the login callbacks of job and tool widgets if the history loaded, then report any errors"""
+        if history_loaded: self.trigger_login()
+        else: self.info, self.busy = '', False
+        if errors: self.report_error("; ".join(errors))
 
     def register_session(self):
         """Register the validated credentials with the SessionList"""
         self.info = 'Registering session'
         session.register(self.session)
 
+    @timed('register_tools')
     def register_tools(self):
         """Get the list available tools and register widgets for them with the tool manager"""
         server = server_name(galaxy_url(self.session))
-        safe_tools = self.safe_tools()
-        tools = [GalaxyTool(server, galaxy_tool) for galaxy_tool in safe_tools]
-        tools.append(GalaxyUploadTool(server, self.session))
+        cached = tool_cache.load(self.session.gi.url)
+
+        # If the catalogue is cached, register it immediately and check whether it is stale in the background
+        if cached:
+            index = tool_cache.index(self.session.gi.url, tool_cache.tools(self.session, cached))
+            self.register_tool_list(server, index.records)
+            Thread(target=self.revalidate_tools, args=(server, cached), daemon=True).start()
+        else:
+            index = self.safe_tools()
+            self.register_tool_list(server, index.records)
+            try: tool_cache.save(self.session.gi.url, index.tools(), tool_cache.galaxy_version(self.session))
+            except ConnectionError: pass  # Version unknown, the catalogue will be fetched again next login
+
+    def register_tool_list(self, server, records):
+        """
+        Register the given tool records with the tool manager, plus the upload tool, streaming them in chunks.
+        Each chunk is queued on the kernel's thread, so the other registry changes are made before or after it.
+        """
         self.info = 'Registering tools'
+        tools = [GalaxyUploadTool(server, self.session)]
+        start, chunk = 0, self.first_chunk
+        while True:     # Each update re-sends the whole registry, doubling the chunks keeps the total within 2x of one
+            tools += [GalaxyTool(server, record) for record in records[start:start + chunk]]
+            on_kernel_thread(GalaxyAuthWidget.register_chunk, tools)
+            start, chunk, tools = start + chunk, chunk * 2, []
+            if start >= len(records): break
+
+    @staticmethod
+    def register_chunk(tools):
         ToolManager.instance().register_all(tools, auto_load=False)
 
-    def safe_tools(self):
-        self.info = 'Querying Galaxy for list of tools'
-        raw_list = self.session.tools.list()
-        safe_list = OrderedDict()
-        for galaxy_tool in raw_list:
-            if skip_tool(galaxy_tool): continue
-            base_id = strip_version(galaxy_tool.id)
-            if GalaxyAuthWidget.later_version(safe_list.get(base_id), galaxy_tool):
-                safe_list[base_id] = galaxy_tool
-        return list(safe_list.values())
+    def revalidate_tools(self, server, cached):
+        """Download the tool list if the cached catalogue is stale, and swap in the fresh one if it has changed"""
+        try:
+            galaxy_version = tool_cache.galaxy_version(self.session)
+            if tool_cache.is_fresh(cached, galaxy_version): return
+            index = tool_cache.index(self.session.gi.url, self.session.tools.list())
+            fresh = tool_cache.save(self.session.gi.url, index.tools(), galaxy_version)
+        except ConnectionError: return  # Keep using the cached catalogue
+        except Exception as e: return on_kernel_thread(self.report_error, e)
+        if fresh['tools'] != cached['tools']: on_kernel_thread(self.replace_tools, server, cached, index)
 
-    @staticmethod
-    def later_version(tool_a, tool_b):
-        """Returns true if tool_b has a later version number than tool_a"""
-        # Handle the None cases
-        if tool_a is None: return True
-        if tool_b is None: return False
+    def replace_tools(self, server, cached, index):
+        """Unregister the cached tools which are no longer available, then register the new catalogue"""
+        try:
+            available = index.base_ids()
+            for record in cached['tools']:
+                tool_id = strip_version(record['id'])
+                if tool_id not in available and ToolManager.exists(tool_id, server): ToolManager.unregister(server, tool_id)
+            self.register_tool_list(server, index.records)
+            self.info = ''
+        except Exception as e: self.report_error(e)
 
-        # Parse versions to make sure they work
-        try: version_b = Version(tool_b.version)
-        except InvalidVersion: return False
-        try: version_a = Version(tool_a.version)
-        except InvalidVersion: return True
+    def report_error(self, error):
+        self.error = f'Error loading data from Galaxy: {error}'
 
-        return version_a <= version_b
+    @timed('safe_tools')
+    def safe_tools(self):
+        """Query Galaxy for its tools, return the index of the latest version of each supported tool"""
+        self.info = 'Querying Galaxy for list of tools'
+        return tool_cache.index(self.session.gi.url, self.session.tools.list())
 
+    @timed('register_history')
     def register_history(self, reload=False):
-        data_list = []
         origin = server_name(galaxy_url(self.session))
 
-        # Load histories
+        # Load the most recently updated histories
         self.info = 'Querying Galaxy for histories'
-        if DataManager.origin_exists(origin): DataManager.instance().unregister_all(origin, skip_update=True)
-        loaded_histories = self.session.histories.list()[:20]
-        if not reload: self.session.current_history = loaded_histories[0]
+        loaded_histories = list_histories(self.session, limit=20)
+        if not reload: self.session.current_history = History(loaded_histories[0], gi=self.session)
 
         # Register the Galaxy origin with working buttons
         def refresh_callback(option):
@@ -155,29 +210,66 @@ class GalaxyAuthWidget(UIBuilder):
             # Set the current history
             self.busy = True
             self.info = 'Switching current Galaxy history'
-            self.session.current_history = self.session.histories.get(option)
+            self.session.current_history = get_history(self.session, option)
             self.register_history(reload=True)
             EventManager.instance().dispatch("galaxy.history_refresh", { 'session': self.session, 'poll': False })
             self.busy = False
 
+        def more_callback(option):
+            self.busy = True
+            self.info = 'Querying Galaxy for more history contents'
+            self.load_more_contents()
+            self.busy = False
+
         origin_obj = NBOrigin(name=origin, click_disabled=True, description='Current Galaxy History', buttons=[
             {'name': 'Refresh Histories', 'icon': 'fa fa-refresh', 'callback': refresh_callback},
             {'name': 'Switch History', 'icon': 'fa fa-exchange-alt', 'options':
-                [{ 'label': history.name, 'value': history.id } for history in loaded_histories], 'callback': switch_callback}
+                [{ 'label': history['name'], 'value': history['id'] } for history in loaded_histories], 'callback': switch_callback},
+            {'name': 'Load More Datasets', 'icon': 'fa fa-angle-double-down', 'callback': more_callback}
         ])
+
+        # If reloading the same history, only apply the changes since it was last synced
+        history = current_history(self.session)
+        if reload and self.history_sync and self.history_sync.history.id == history.id:
+            self.info = 'Querying Galaxy for changes to the history'
+            on_kernel_thread(GalaxyAuthWidget.register_origin, origin, origin_obj, False)
+            self.history_sync.sync()
+            self.info = 'History successfully reloaded'
+            return
+
+        # Otherwise, add data entries for the first page of output files, the rest are loaded on demand
+        on_kernel_thread(GalaxyAuthWidget.register_origin, origin, origin_obj, True)
+        self.pager = HistoryPager(self.session, history.id)
+        self.history_sync = HistorySync(self.session, origin, history)
+        self.load_more_contents()
+        self.info = 'History successfully reloaded'
+
+    @staticmethod
+    def register_origin(origin, origin_obj, replace):
+        """Register the Galaxy origin with the data panel, first removing its data entries if replacing them"""
+        if replace and DataManager.origin_exists(origin): DataManager.instance().unregister_all(origin, skip_update=True)
         DataManager.instance().register_origin(origin_obj)
 
-        # Add data entries for all output files
+    def load_more_contents(self):
+        """
+        Query the next page of the current history's contents and register it with the data panel on the kernel's
+        thread, return the number added
+        """
+        if self.pager is None: return 0
+        origin = server_name(galaxy_url(self.session))
         history = current_history(self.session)
-        for content in history.content_infos[:100]:
-            if content.wrapped['deleted']: continue
-            kind = 'error' if content.state == 'error' else (content.wrapped['extension'] if 'extension' in content.wrapped else '')
-            data = Data(origin=origin, group=history.name, uri=content.id, label=data_name(content), kind=kind, icon=data_icon(content.state))
-            data_list.append(data)
+        data_list = []
+        page = self.pager.next_page()
+        self.history_sync.observe(page)
+        dataset_index(self.session, history.id).update(page)
+        for content in page:
+            content = HistoryContentInfo(content, gi=self.session)
+            data_list.append(content_data(origin, history.name, content))
             poll_data_and_update(content)
         self.info = 'Registering history contents'
-        DataManager.instance().register_all(data_list)
-        self.info = 'History successfully reloaded'
+        on_kernel_thread(DataManager.instance().register_all, data_list)
+        self.info = '' if data_list or not self.pager.exhausted else 'All datasets in the history have been loaded'
+        return len(data_list)
 
     def trigger_login(self):
         """Dispatch a login event after authentication"""
@@ -198,6 +290,6 @@ class AuthenticationTool(NBTool):
     load = lambda x: GalaxyAuthWidget()
 
 
-# Register the authentication widget
-ToolManager.instance().register(AuthenticationTool())
+# Register the authentication widget, if imported in a kernel rather than by a script such as a benchmark
+if getattr(get_ipython(), 'kernel', None) is not None: ToolManager.instance().register(AuthenticationTool())
 
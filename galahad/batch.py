@@ -0,0 +1,99 @@
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from bioblend import ConnectionError
+from bioblend.galaxy.objects.wrappers import HistoryDatasetAssociation
+from nbtools import UIOutput, DataManager
+from .index import dataset_index
+from .polling import poller, TERMINAL_STATES
+from .utils import (GALAXY_LOGO, session_color, galaxy_url, server_name, content_data, poll_data_and_update, data_name,
+                    on_kernel_thread)
+
+
+def batch_values(dataset_ids):
+    """Return a data parameter value which makes Galaxy run one job per dataset, mapping the tool over them"""
+    return {'batch': True, 'values': [{'id': dataset_id, 'src': 'hda'} for dataset_id in dataset_ids]}
+
+
+def run_tool(tool, history, spec):
+    """Submit one tools.run request, returning wrappers built from the response without fetching each output"""
+    response = tool.gi.gi.tools.run_tool(history.id, tool.id, spec)
+    return [HistoryDatasetAssociation(output, container=history, gi=tool.gi) for output in response['outputs']]
+
+
+class BatchSubmitter:
+    """Submits many job requests for a tool with bounded concurrency, reporting their outputs to a batch widget"""
+    max_workers = 4     # Concurrent tools.run requests, Galaxy queues the jobs themselves
+
+    def __init__(self, tool, history, widget, max_workers=None):
+        self.tool = tool
+        self.history = history
+        self.widget = widget
+        self.max_workers = max_workers or self.max_workers
+
+    def submit(self, specs):
+        """Submit a request for each job spec in the background, return immediately"""
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='galahad-batch')
+        futures = [executor.submit(self.submit_one, spec) for spec in specs]
+        executor.shutdown(wait=False)
+        return futures
+
+    def submit_one(self, spec):
+        try: self.widget.add_outputs(run_tool(self.tool, self.history, spec))
+        except ConnectionError as e:
+            self.widget.add_error(json.loads(e.body)['err_msg'] if hasattr(e, 'body') else f'Unknown error running Galaxy tool: {e}')
+        except Exception as e: self.widget.add_error(f'Unknown Error: {e}')
+
+
+class GalaxyBatchWidget(UIOutput):
+    """A single widget reporting the progress of every job in a batch, in place of one widget per output"""
+
+    def __init__(self, tool, history, requests, **kwargs):
+        self.tool = tool
+        self.history = history
+        self.requests = requests        # Number of tools.run requests in the batch
+        self.answered = 0               # Number of requests which have returned, successfully or not
+        self.outputs = {}               # Map of dataset ID -> output wrapper, updated in place by the poller
+        self.errors = []
+        self.lock = Lock()
+        kwargs = {'name': f'{tool.name} Batch', 'origin': server_name(galaxy_url(tool.gi)), 'logo': GALAXY_LOGO,
+                  'color': session_color(galaxy_url(tool.gi), secondary_color=True), **kwargs}
+        UIOutput.__init__(self, default_file_menu_items=False, attach_file_prefixes=False, **kwargs)
+        self.render()
+
+    def add_outputs(self, outputs):
+        """Track the outputs of a submitted request with the session's shared poller"""
+        with self.lock:
+            self.answered += 1
+            for output in outputs: self.outputs[output.id] = output
+        origin = server_name(galaxy_url(self.tool.gi))
+        data = [content_data(origin, self.history.name, o) for o in outputs]
+        on_kernel_thread(DataManager.instance().register_all, data)     # Queued ahead of the poller's state updates
+        dataset_index(self.tool.gi, self.history.id).update([o.wrapped for o in outputs])
+        for output in outputs:
+            poll_data_and_update(output)                        # Keep the data panel's icon up to date
+            poller(self.tool.gi).watch(output, self.state_callback)
+        self.render()
+
+    def add_error(self, error):
+        with self.lock:
+            self.answered += 1
+            self.errors.append(error)
+        self.render()
+
+    def state_callback(self, dataset):
+        self.render()
+
+    def render(self):
+        """Summarize the batch's progress in the widget"""
+        with self.lock:
+            outputs, errors, answered = list(self.outputs.values()), list(self.errors), self.answered
+        counts = Counter(o.state for o in outputs)
+        finished = answered == self.requests and all(o.state in TERMINAL_STATES for o in outputs)
+
+        self.status = ('Complete' if finished else 'Running') + (f' with {len(errors)} failed submissions' if errors else '')
+        self.description = f'{answered} of {self.requests} job requests submitted, {len(outputs)} outputs: ' + \
+            (', '.join(f'{n} {state}' for state, n in sorted(counts.items())) or 'none yet')
+        self.files = [(o.id, data_name(o), o.wrapped.get('extension', '')) for o in outputs if o.state == 'ok']
+        self.text = '\n'.join(errors)
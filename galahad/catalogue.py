@@ -0,0 +1,180 @@
+import json
+import os
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from hashlib import sha1
+from threading import Lock
+from time import time
+from bioblend.galaxy.objects.wrappers import Tool
+from packaging.version import Version, InvalidVersion
+from .utils import cache_dir, skip_tool, strip_version
+
+TOOL_KEYS = ('id', 'name', 'version', 'description', 'panel_section_name')
+
+
+def tool_record(tool):
+    """Return the compact, JSON-serializable record of a Galaxy tool that gets cached"""
+    return {k: tool.wrapped.get(k) for k in TOOL_KEYS}
+
+
+@lru_cache(maxsize=4096)
+def parse_version(version):
+    """Parse a tool version for comparison, None if it isn't a valid version number. Tools share most versions."""
+    try: return Version(version)
+    except (InvalidVersion, TypeError): return None
+
+
+def tokenize(text):
+    """Split text into the lowercase words it is searched by"""
+    return re.findall(r'[a-z0-9]+', (text or '').lower())
+
+
+class ToolRecord:
+    """The fields of a Galaxy tool needed to deduplicate, search and register it, without the rest of its JSON"""
+    __slots__ = ('gi', 'id', 'base_id', 'name', 'description', 'section', 'version', 'parsed_version')
+
+    def __init__(self, tool):
+        self.gi = tool.gi
+        self.id = tool.id
+        self.base_id = strip_version(tool.id)                   # ID shared by every version of the tool
+        self.name = tool.name
+        self.description = tool.wrapped.get('description')
+        self.section = tool.wrapped.get('panel_section_name')
+        self.version = tool.version
+        self.parsed_version = parse_version(tool.version)      # None if the version can't be compared
+
+    def tool(self):
+        """Return a bioblend Tool wrapper of the record, whose inputs are fetched from Galaxy when it is loaded"""
+        return Tool({'id': self.id, 'name': self.name, 'version': self.version, 'description': self.description,
+                     'panel_section_name': self.section}, gi=self.gi)
+
+    def supersedes(self, other):
+        """Is this a later version of the same tool, keeping the existing record if this version is invalid"""
+        if other is None: return True
+        if self.parsed_version is None: return False
+        if other.parsed_version is None: return True
+        return other.parsed_version <= self.parsed_version
+
+    def tokens(self):
+        return set(tokenize(f'{self.id} {self.name} {self.description or ""} {self.section or ""}'))
+
+
+class ToolIndex:
+    """The latest version of each supported tool in a Galaxy catalogue, built in one pass and searchable by prefix"""
+
+    def __init__(self, raw_list):
+        latest = {}         # Map of base ID -> record of its latest version, in the order tools were first seen
+        for galaxy_tool in raw_list:
+            if skip_tool(galaxy_tool): continue
+            record = ToolRecord(galaxy_tool)
+            if record.supersedes(latest.get(record.base_id)): latest[record.base_id] = record
+        self.records = list(latest.values())
+        self.postings = None    # Map of token -> ascending positions in records of the tools which contain it
+        self.vocabulary = None  # Sorted tokens, so each prefix is a contiguous run
+        self.lock = Lock()
+
+    def build_search(self):
+        """Build the search structure on first use, so that registering the catalogue at login doesn't wait on it"""
+        with self.lock:
+            if self.vocabulary is not None: return
+            postings = {}
+            for position, record in enumerate(self.records):
+                for token in record.tokens(): postings.setdefault(token, []).append(position)
+            self.postings, self.vocabulary = postings, sorted(postings)
+
+    def __len__(self):
+        return len(self.records)
+
+    def tools(self):
+        """Return a bioblend Tool wrapper of each tool in the index"""
+        return [record.tool() for record in self.records]
+
+    def base_ids(self):
+        return {record.base_id for record in self.records}
+
+    def matching(self, prefix):
+        """Return the positions of the tools with a word starting with the prefix"""
+        self.build_search()
+        positions = set()
+        for i in range(bisect_left(self.vocabulary, prefix), len(self.vocabulary)):
+            if not self.vocabulary[i].startswith(prefix): break
+            positions.update(self.postings[self.vocabulary[i]])
+        return positions
+
+    def search(self, query, limit=None):
+        """Return the records of tools with a word starting with each word of the query, in catalogue order"""
+        words = tokenize(query)
+        if not words: return self.records[:limit]
+        positions = None
+        for word in sorted(set(words), key=len, reverse=True):     # Longest prefixes first, they match the fewest
+            positions = self.matching(word) if positions is None else positions & self.matching(word)
+            if not positions: return []
+        return [self.records[i] for i in sorted(positions)[:limit]]
+
+
+class ToolCatalogueCache:
+    """Keeps the deduplicated tool list of each Galaxy server on disk, so that logins don't wait on the server"""
+    ttl = 24 * 60 * 60  # Seconds before a cached catalogue is re-downloaded, even if Galaxy's version is unchanged
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.indexes = {}   # Map of server URL -> ToolIndex of the catalogue currently registered from it
+
+    def path(self, server_url):
+        """Return the path of the cache file for the given server"""
+        digest = sha1(server_url.rstrip('/').encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.directory or cache_dir(), f'tools-{digest}.json')
+
+    def load(self, server_url):
+        """Return the cached catalogue entry for the server, None if there isn't a readable one"""
+        try:
+            with open(self.path(server_url)) as f: entry = json.load(f)
+        except (OSError, ValueError): return None
+        if not isinstance(entry, dict) or entry.get('server') != server_url or 'tools' not in entry: return None
+        return entry
+
+    def save(self, server_url, tools, galaxy_version):
+        """Write the list of tools to the server's cache file, return the new catalogue entry"""
+        entry = {'server': server_url, 'galaxy_version': galaxy_version, 'timestamp': time(),
+                 'tools': [tool_record(t) for t in tools]}
+        path = self.path(server_url)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f'{path}.tmp', 'w') as f: json.dump(entry, f)
+            os.replace(f'{path}.tmp', path)  # Atomic, so readers never see a partial file
+        except OSError: pass  # The cache is an optimization, carry on without it
+        return entry
+
+    def is_fresh(self, entry, galaxy_version):
+        """Is the cached entry recent enough and from the same Galaxy release as the server now reports"""
+        return entry.get('galaxy_version') == galaxy_version and time() - entry.get('timestamp', 0) < self.ttl
+
+    def index(self, server_url, raw_list):
+        """Build the index of a catalogue and keep it as the server's current one, return the index"""
+        self.indexes[server_url] = ToolIndex(raw_list)
+        return self.indexes[server_url]
+
+    def search(self, query, server_url=None, limit=None):
+        """Search the current catalogue of the given server, or of every server, return the matching records"""
+        if server_url is None: indexes = list(self.indexes.values())
+        else: indexes = [self.indexes[server_url]] if server_url in self.indexes else []
+        matches = [record for index in indexes for record in index.search(query, limit)]
+        return matches[:limit]
+
+    @staticmethod
+    def tools(session, entry):
+        """Return the cached records as bioblend Tool wrappers bound to the given session"""
+        return [Tool(record, gi=session) for record in entry['tools']]
+
+    @staticmethod
+    def galaxy_version(session):
+        """Query the Galaxy server's release, used to invalidate the cache on upgrades"""
+        version = session.gi.config.get_version()
+        return f"{version.get('version_major')}.{version.get('version_minor')}"
+
+
+"""
+Tool Catalogue Cache Singleton
+"""
+tool_cache = ToolCatalogueCache()
@@ -1,7 +1,13 @@
-from threading import Timer
+from threading import Thread
 from bioblend import ConnectionError
 from bioblend.galaxy.objects.wrappers import Dataset, HistoryDatasetAssociation
 from nbtools import UIOutput, EventManager, ToolManager, DataManager, Data
+from .api import history_id
+from .downloads import ProgressThrottle, dataset_cache, progress_text
+from .hydration import hydrator
+from .index import dataset_index
+from .polling import poller
+from .preview import read_dataset
 from .sessions import session
 from .utils import GALAXY_LOGO, server_name, session_color, galaxy_url, data_icon, poll_data_and_update, data_name
 
@@ -19,8 +25,8 @@ class GalaxyDatasetWidget(UIOutput):
                           **kwargs)
         self.poll(**kwargs)  # Query the Galaxy server and begin polling, if needed
 
-        # Register the event handler for Galaxy login
-        EventManager.instance().register("galaxy.login", self.login_callback)
+        # Register the event handler for Galaxy login, which is called once every widget's dataset is resolved
+        hydrator.track(self, 'dataset')
 
     def dataset_origin(self):
         if self.initialized(): return server_name(galaxy_url(self.dataset.gi))
@@ -61,6 +67,7 @@ class GalaxyDatasetWidget(UIOutput):
                 else: all_data.append(Data(origin=self.origin, group=group, icon=data_icon(self.dataset.state), uri=f))
                 DataManager.instance().group_widget(origin=self.origin, group=group, widget=self)
             DataManager.instance().register_all(all_data)
+            dataset_index(self.dataset.gi, history_id(self.dataset)).update([self.dataset.wrapped])
             poll_data_and_update(self.dataset)
             EventManager.instance().dispatch("galaxy.history_refresh", {'session': session.get(0), 'poll': True})  # Update data parameters
 
@@ -105,10 +112,12 @@ class GalaxyDatasetWidget(UIOutput):
             if 'error' not in kwargs: self.error = 'You must authenticate before the dataset can be displayed. After you authenticate it may take a few seconds for the information to appear.'
 
     def poll_if_needed(self):
-        """Begin a polling interval if the job is pending or running"""
-        if not self.dataset.state == 'ok' and not self.dataset.state == 'error':
-            timer = Timer(15.0, lambda: self.dataset.refresh() and self.poll())
-            timer.start()
+        """Watch the dataset with the session's shared poller if the job is pending or running"""
+        poller(self.dataset.gi).watch(self.dataset, self.state_callback)
+
+    def state_callback(self, dataset):
+        """Callback for when the shared poller detects a change in the dataset's state"""
+        self.poll()
 
     def submitted_text(self):
         """Return pretty dataset submission text"""
@@ -132,8 +141,26 @@ class GalaxyDatasetWidget(UIOutput):
         else:                                   return self.dataset.state
 
     def workspace_download(self, file_name):
-        with open(file_name, 'wb') as f:
-            self.dataset.download(f)
+        """Download the dataset to the workspace in the background, showing its progress in the widget"""
+        def report(text): self.info = text
+        throttle = ProgressThrottle(report)
+        def progress(received, total): throttle(progress_text(self.dataset.name, received, total))
+
+        def run_download():
+            try:
+                dataset_cache.download(self.dataset, file_name, progress=progress)
+                self.info = f'Downloaded {self.dataset.name} to {file_name}'
+            except Exception as e:
+                self.info = ''
+                self.error = f'Error downloading {self.dataset.name}: {e}'
+
+        self.error = ''
+        self.info = f'Downloading {self.dataset.name}...'
+        Thread(target=run_download, daemon=True, name='galahad-download').start()
+
+    def dataframe(self, nrows=None, byte_range=None, cache=False, **kwargs):
+        """Read the dataset into a pandas DataFrame without saving it to the workspace, see galahad.read_dataset()"""
+        return read_dataset(self.dataset, nrows=nrows, byte_range=byte_range, cache=cache, **kwargs)
 
     def initialize(self, session):
         """Retrieve the Dataset object from the session, return whether it is initialized"""
@@ -142,7 +169,7 @@ class GalaxyDatasetWidget(UIOutput):
 
         # Attempt to initialize the dataset
         try:
-            self.dataset = session.datasets.get(self.dataset)
+            self.dataset = hydrator.resolved('dataset', self.dataset) or session.datasets.get(self.dataset)
             self.error = ''
             self.set_color()
             return True
@@ -0,0 +1,429 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic, time_ns
+from urllib.parse import urljoin
+from bioblend.galaxy.objects.wrappers import HistoryContentInfo
+from requests.exceptions import RequestException
+from .api import get_history
+from .sessions import session
+from .stats import metrics
+from .sync import HistoryPager
+from .transport import attach_transport
+from .utils import format_bytes, current_history, cache_dir
+
+try: import fcntl
+except ImportError: fcntl = None    # Not on Windows, where datasets are always copied
+
+HASH_FUNCTIONS = {'MD5': 'md5', 'SHA-1': 'sha1', 'SHA-256': 'sha256', 'SHA-512': 'sha512'}  # Galaxy -> hashlib
+FICLONE = 0x40049409    # Linux ioctl which makes a file share another's blocks copy-on-write
+
+
+def download_url(session, details):
+    """Return the URL bioblend downloads a dataset from, given the dataset's full details"""
+    ext = details.get('file_ext')
+    if not ext or ext in ('auto', '_sniff_'): ext = 'data'     # Galaxy's placeholders for an unknown extension
+    return urljoin(session.gi.base_url, f"{details['download_url']}?to_ext={ext}")   # The path includes any prefix
+
+
+def expected_hash(details):
+    """Return the (hashlib name, hex digest) of a hash Galaxy has recorded for the dataset, None if there are none"""
+    for h in details.get('hashes') or []:
+        if h.get('hash_function') in HASH_FUNCTIONS: return HASH_FUNCTIONS[h['hash_function']], h['hash_value']
+    return None
+
+
+class DatasetDownload:
+    """Streams a dataset to a workspace file in chunks, resuming partial downloads and verifying what was received"""
+    chunk_size = 1024 * 1024    # Bytes read from the response and written to disk at a time
+    attempts = 4                # Connections made before giving up, each resuming where the last stopped
+
+    def __init__(self, dataset, path, progress=None, details=None):
+        """
+        :param dataset: the bioblend dataset wrapper
+        :param path: the file to write, which is only replaced once the download has been verified
+        :param progress: called as progress(received, total) as the download proceeds
+        :param details: the dataset's full details from Galaxy, queried if not given
+        """
+        self.dataset = dataset
+        self.path = path
+        self.progress = progress
+        self.details = details
+        self.partial = f'{path}.{dataset.id}.part'  # Named for the dataset, so it is never resumed from another
+        self.digest = None                          # Running hash of the partial file, if Galaxy has recorded one
+        self.hashed = 0                             # Number of bytes of the partial file fed to the digest
+
+    def run(self):
+        """Download the dataset, return the path it was saved to"""
+        session = self.dataset.gi
+        if self.details is None: self.details = session.gi.datasets.show_dataset(self.dataset.id)
+        if self.details.get('state') != 'ok':
+            raise OSError(f"{self.dataset.name} can't be downloaded while its state is {self.details.get('state')}")
+        size = self.details.get('file_size')
+
+        with metrics.timed('dataset_download'):
+            for attempt in range(self.attempts):
+                try:
+                    if self.fetch(session, size): break
+                except RequestException:
+                    if attempt == self.attempts - 1: raise
+        self.verify(size)
+        os.replace(self.partial, self.path)     # Atomic, so the file is either absent or complete
+        return self.path
+
+    def received(self):
+        return os.path.getsize(self.partial) if os.path.exists(self.partial) else 0
+
+    def fetch(self, session, size):
+        """Request everything after the bytes already received and append it, return whether the file is complete"""
+        offset = self.received()
+        if size is not None and 0 < size <= offset: return True
+        transport = attach_transport(session)
+        headers = {**session.gi.json_headers, 'Range': f'bytes={offset}-'} if offset else session.gi.json_headers
+        with transport.get(download_url(session, self.details), stream=True, headers=headers) as r:
+            if r.status_code == 416: return True    # Nothing left to send
+            r.raise_for_status()
+            if r.status_code != 206: offset = 0     # Server ignored the range, so start over
+            self.rehash(offset)
+            if self.progress: self.progress(offset, size)
+            with open(self.partial, 'ab' if offset else 'wb') as f:
+                for chunk in r.iter_content(chunk_size=self.chunk_size):
+                    f.write(chunk)
+                    offset += len(chunk)
+                    if self.digest is not None: self.digest.update(chunk)
+                    self.hashed = offset
+                    if self.progress: self.progress(offset, size)
+        return True
+
+    def rehash(self, offset):
+        """Bring the digest up to date with the first offset bytes of the partial file, if a hash is to be checked"""
+        recorded = expected_hash(self.details)
+        if recorded is None or (self.digest is not None and self.hashed == offset): return
+        self.digest, self.hashed = hashlib.new(recorded[0]), 0
+        if not offset: return
+        with open(self.partial, 'rb') as f:
+            while self.hashed < offset:
+                block = f.read(min(self.chunk_size, offset - self.hashed))
+                if not block: break
+                self.digest.update(block)
+                self.hashed += len(block)
+
+    def verify(self, size):
+        """Check the received file against the size and hash Galaxy reports, discarding it if it doesn't match"""
+        received = self.received()
+        if size is not None and received != size:
+            os.remove(self.partial)
+            raise OSError(f'Downloaded {format_bytes(received)} of {self.dataset.name}, expected {format_bytes(size)}')
+
+        recorded = expected_hash(self.details)
+        if recorded is None: return
+        self.rehash(received)
+        if self.digest.hexdigest() != recorded[1]:
+            os.remove(self.partial)
+            raise OSError(f'Downloaded copy of {self.dataset.name} does not match its {recorded[0]} hash')
+
+
+def progress_text(name, received, total):
+    """Return the progress of a single download"""
+    if total: return f'Downloading {name}: {format_bytes(received)} of {format_bytes(total)} ({received * 100 // total}%)'
+    else: return f'Downloading {name}: {format_bytes(received)}'
+
+
+class ProgressThrottle:
+    """Passes progress text on to report(text) at most once per interval, so that widgets aren't flooded with updates"""
+    interval = 0.25
+
+    def __init__(self, report):
+        self.report = report
+        self.last = 0
+        self.lock = Lock()
+
+    def __call__(self, text, force=False):
+        with self.lock:
+            if not force and monotonic() - self.last < self.interval: return
+            self.last = monotonic()
+        self.report(text)
+
+
+def content_key(session, details):
+    """Return the cache key of a dataset's contents, from its server, ID and hash (or size and update time if unhashed)"""
+    recorded = expected_hash(details)
+    version = f'{recorded[0]}:{recorded[1]}' if recorded else f"{details.get('file_size')}:{details.get('update_time')}"
+    return hashlib.sha1(f"{session.gi.url}|{details['id']}|{version}".encode('utf-8')).hexdigest()
+
+
+class DatasetCache:
+    """LRU cache of downloaded datasets on local disk, shared by downloads and previews, bounded by total size"""
+    max_bytes = 10 * 1024 * 1024 * 1024    # Least recently used files are evicted to keep the cache within this size
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = max_bytes if max_bytes is not None else self.max_bytes
+        self.lock = Lock()
+        self.key_locks = {}     # Map of key -> lock held while the key's file is downloaded
+        self.fetching = set()   # Keys being downloaded now, whose partial files mustn't be evicted
+
+    def path(self, key):
+        return os.path.join(self.directory or os.path.join(cache_dir(), 'datasets'), key)
+
+    def cacheable(self, details):
+        """Ready datasets which fit within the cache are kept, Galaxy may still change the rest"""
+        return details.get('state') == 'ok' and 0 < (details.get('file_size') or 0) <= self.max_bytes
+
+    def lookup(self, session, details):
+        """Return the path of the cached copy of the dataset, None if it isn't cached"""
+        path = self.path(content_key(session, details))
+        if not os.path.isfile(path) or os.path.getsize(path) != details.get('file_size'): return None
+        try: os.utime(path, ns=(time_ns(), os.stat(path).st_mtime_ns))  # Mark as used, the atime orders eviction
+        except OSError: pass
+        return path
+
+    def fetch(self, dataset, details, progress=None):
+        """Return the path of the cached copy of the dataset, downloading it into the cache first if necessary"""
+        key = content_key(dataset.gi, details)
+        with self.lock: key_lock = self.key_locks.setdefault(key, Lock())
+        with key_lock:  # Only one download of each dataset at a time, the rest wait and use it
+            path = self.lookup(dataset.gi, details)
+            if path: return path
+            path = self.path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with self.lock: self.fetching.add(key)
+            try: DatasetDownload(dataset, path, progress=progress, details=details).run()
+            finally:
+                with self.lock: self.fetching.discard(key)
+            os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)  # Cached contents must match their key
+        self.evict(keep=path)
+        return path
+
+    def download(self, dataset, target, progress=None, details=None):
+        """Download the dataset to the target path by way of the cache, return the target path"""
+        if details is None: details = dataset.gi.gi.datasets.show_dataset(dataset.id)
+        if not self.cacheable(details): return DatasetDownload(dataset, target, progress=progress, details=details).run()
+        path = self.fetch(dataset, details, progress)
+        DatasetCache.materialize(path, target)
+        return target
+
+    @staticmethod
+    def materialize(path, target):
+        """
+        Place a writable copy of a cached file at the target, as a copy-on-write clone if the file system supports it.
+        Never a hard link, which would share the cache's read-only file and let edits change its contents.
+        """
+        temp = f'{target}.{os.getpid()}.copy'
+        try:
+            with open(path, 'rb') as source, open(temp, 'wb') as copy: cloned = DatasetCache.clone(source, copy)
+            if not cloned: shutil.copyfile(path, temp)  # Copies in the kernel where it can
+            os.replace(temp, target)    # Atomic, so the target is never partial
+        except BaseException:
+            if os.path.exists(temp): os.remove(temp)
+            raise
+
+    @staticmethod
+    def clone(source, copy):
+        """Make the copy share the source's blocks, return whether the file system could (Btrfs, XFS and the like)"""
+        if fcntl is None: return False
+        try: fcntl.ioctl(copy.fileno(), FICLONE, source.fileno())
+        except OSError: return False
+        return True
+
+    def usage(self):
+        """Return the total size of the cache in bytes, and its files as (last used, size, path), least recent first"""
+        directory = os.path.dirname(self.path('_'))
+        try: entries = list(os.scandir(directory))
+        except OSError: return 0, []
+        files = sorted((e.stat().st_atime, e.stat().st_size, e.path) for e in entries if e.is_file())
+        return sum(f[1] for f in files), files
+
+    def evict(self, keep=None):
+        """Remove least recently used files until the cache is within its size limit"""
+        with self.lock:
+            total, files = self.usage()
+            for _, size, path in files:
+                if total <= self.max_bytes: break
+                if path == keep or os.path.basename(path).split('.')[0] in self.fetching: continue
+                try: os.remove(path)
+                except OSError: continue
+                total -= size
+
+    def clear(self):
+        """Remove every cached dataset"""
+        with self.lock:
+            for _, _, path in self.usage()[1]:
+                try: os.remove(path)
+                except OSError: pass
+
+
+"""
+Dataset Cache Singleton
+"""
+dataset_cache = DatasetCache()
+
+
+def safe_file_name(name):
+    """Replace the characters of a Galaxy name which don't belong in a file name"""
+    return re.sub(r'[^\w.\-]+', '_', name)
+
+
+def local_name(content):
+    """Return a workspace file name for a history dataset, unique within the history"""
+    return safe_file_name(f"{content['hid']}_{content['name']}")
+
+
+def matches(path, details, chunk_size=DatasetDownload.chunk_size):
+    """Return whether a local file has the size and, if Galaxy has recorded one, the hash of the dataset"""
+    if not os.path.isfile(path) or os.path.getsize(path) != details.get('file_size'): return False
+    recorded = expected_hash(details)
+    if recorded is None: return True
+    digest = hashlib.new(recorded[0])
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''): digest.update(block)
+    return digest.hexdigest() == recorded[1]
+
+
+class HistoryDownload:
+    """Downloads the datasets of a history to a workspace directory in parallel, transferring only what has changed"""
+    max_workers = 4                 # Concurrent dataset downloads
+    manifest_name = '.galahad-sync.json'
+
+    def __init__(self, gi, history, directory, select=None, max_workers=None, progress=None):
+        """
+        :param gi: the Galaxy session
+        :param history: the bioblend History wrapper
+        :param directory: the workspace directory to download into, created if necessary
+        :param select: a list of dataset IDs, or a function given each content dict which returns whether to download it
+        :param max_workers: number of datasets to download concurrently
+        :param progress: called as progress(text) with the aggregate progress, at most a few times a second
+        """
+        self.gi = gi
+        self.history = history
+        self.directory = directory
+        self.select = select
+        self.max_workers = max_workers or self.max_workers
+        self.progress = ProgressThrottle(progress) if progress else None
+        self.manifest = {}      # Map of dataset ID -> {name, update_time, size, mtime} of each file downloaded
+        self.results = {'downloaded': [], 'unchanged': [], 'failed': {}}
+        self.count = 0          # Number of selected datasets
+        self.total = 0          # Size of the selected datasets checked so far, in bytes
+        self.transferred = 0    # Bytes received by this run, which excludes resumed and unchanged files
+        self.started = None
+        self.lock = Lock()
+
+    def selected(self, content):
+        if content.get('state') != 'ok' or content.get('history_content_type', 'dataset') != 'dataset': return False
+        if self.select is None: return True
+        if callable(self.select): return self.select(content)
+        return content['id'] in self.select
+
+    def contents(self):
+        """Return the content dicts of the selected datasets, a page at a time"""
+        pager, contents = HistoryPager(self.gi, self.history.id), []
+        while True:
+            page = pager.next_page()
+            if not page: return contents
+            contents.extend(c for c in page if self.selected(c))
+
+    def run(self):
+        """Download the selected datasets, return a summary of what was transferred"""
+        os.makedirs(self.directory, exist_ok=True)
+        self.manifest = self.load_manifest()
+        contents = self.contents()
+        self.count, self.total = len(contents), 0
+        self.started = monotonic()
+        try:
+            with metrics.timed('history_download'):
+                with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='galahad-download') as executor:
+                    for _ in executor.map(self.download_one, contents): pass
+        finally: self.save_manifest()
+        if self.progress: self.progress(self.progress_text(), force=True)
+        return self.summary()
+
+    def download_one(self, content):
+        path = os.path.join(self.directory, local_name(content))
+        try:
+            if self.unchanged(content, path):
+                with self.lock: self.total += self.manifest[content['id']]['size']
+                return self.finished(content, path, 'unchanged')
+            details = self.gi.gi.datasets.show_dataset(content['id'])   # Contents summaries lack the file size
+            with self.lock: self.total += details.get('file_size') or 0
+            if matches(path, details): return self.finished(content, path, 'unchanged')
+
+            last = [None]   # Bytes received when last counted, starting from those already on disk
+            def count(received, size):
+                with self.lock:
+                    if last[0] is not None: self.transferred += received - last[0] if received >= last[0] else received
+                    last[0] = received
+                if self.progress: self.progress(self.progress_text())
+            dataset_cache.download(HistoryContentInfo(content, gi=self.gi), path, progress=count, details=details)
+            self.finished(content, path, 'downloaded')
+        except Exception as e:
+            with self.lock: self.results['failed'][local_name(content)] = str(e)
+
+    def unchanged(self, content, path):
+        """Is the file the one downloaded last time, with the dataset not updated since, so it needn't be checked"""
+        entry = self.manifest.get(content['id'])
+        if not entry or entry['update_time'] != content.get('update_time') or not os.path.isfile(path): return False
+        stat = os.stat(path)
+        return entry['name'] == os.path.basename(path) and (entry['size'], entry['mtime']) == (stat.st_size, stat.st_mtime_ns)
+
+    def finished(self, content, path, result):
+        stat = os.stat(path)
+        with self.lock:
+            self.results[result].append(path)
+            self.manifest[content['id']] = {'name': os.path.basename(path), 'update_time': content.get('update_time'),
+                                            'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        if self.progress: self.progress(self.progress_text())
+
+    def summary(self):
+        with self.lock:
+            seconds = monotonic() - self.started if self.started else 0
+            return {'downloaded': list(self.results['downloaded']), 'unchanged': list(self.results['unchanged']),
+                    'failed': dict(self.results['failed']), 'size': self.total, 'bytes': self.transferred,
+                    'seconds': seconds, 'throughput': self.transferred / seconds if seconds else 0}
+
+    def progress_text(self):
+        s = self.summary()
+        done = len(s['downloaded']) + len(s['unchanged']) + len(s['failed'])
+        return f"{self.history.name}: {len(s['downloaded'])} downloaded, {len(s['unchanged'])} unchanged" + \
+            (f", {len(s['failed'])} failed" if s['failed'] else '') + \
+            f" ({done} of {self.count} checked, {format_bytes(s['size'])}), {format_bytes(s['bytes'])} received" + \
+            f" at {format_bytes(s['throughput'])}/s"
+
+    def manifest_path(self):
+        return os.path.join(self.directory, self.manifest_name)
+
+    def load_manifest(self):
+        """Return the record of the previous run's downloads, empty if there isn't a readable one"""
+        try:
+            with open(self.manifest_path()) as f: manifest = json.load(f)
+        except (OSError, ValueError): return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    def save_manifest(self):
+        path = self.manifest_path()
+        with self.lock: manifest = dict(self.manifest)
+        try:
+            with open(f'{path}.tmp', 'w') as f: json.dump(manifest, f)
+            os.replace(f'{path}.tmp', path)     # Atomic, so readers never see a partial file
+        except OSError: pass                    # The manifest is an optimization, carry on without it
+
+
+def download_history(history=None, directory=None, select=None, max_workers=None):
+    """
+    Download the datasets of a history to the workspace, skipping those already downloaded and unchanged
+    :param history: a History wrapper or history ID, the current history if not given
+    :param directory: the directory to download into, a new one named for the history if not given
+    :param select: a list of dataset IDs, or a function given each content dict which returns whether to download it
+    :param max_workers: number of datasets to download concurrently
+    :return: a summary of the files downloaded, unchanged and failed, their size, bytes transferred and throughput
+    """
+    gi = session.get(0)
+    if gi is None: raise RuntimeError('You must authenticate before downloading a history')
+    if history is None: history = current_history(gi)
+    elif isinstance(history, str): history = get_history(gi, history)
+    directory = directory or safe_file_name(history.name)
+    return HistoryDownload(gi, history, directory, select=select, max_workers=max_workers).run()
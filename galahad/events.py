@@ -0,0 +1,69 @@
+from threading import Lock
+from weakref import WeakMethod, finalize
+from ipywidgets import Widget
+from nbtools import EventManager
+
+
+class Subscriptions:
+    """Galahad's callbacks for EventManager events, holding widgets weakly and each widget's callback only once"""
+
+    def __init__(self):
+        self.callbacks = {}     # Map of event -> {(id of owner, function): weak method or function}, in order added
+        self.owners = {}        # Map of id of owner -> set of (event, key) subscribed by that owner
+        self.lock = Lock()
+
+    def subscribe(self, event, callback, widget=None):
+        """
+        Call back when the event is dispatched, until the callback's widget is closed or garbage collected
+        :param event: name of the EventManager event
+        :param callback: bound method, held by weak reference, or function, held until its widget closes
+        :param widget: widget whose closing ends the subscription, defaults to the bound method's object
+        """
+        owner = getattr(callback, '__self__', None)
+        key = (id(owner), callback.__func__) if owner is not None else (id(widget), callback)
+        reference = WeakMethod(callback) if owner is not None else callback
+        with self.lock:
+            if event not in self.callbacks:
+                self.callbacks[event] = {}
+                EventManager.instance().register(event, lambda data=None, e=event: self.dispatch(e, data))
+            if key in self.callbacks[event]: return     # Already subscribed, e.g. by a widget rebuilding its form
+            self.callbacks[event][key] = reference
+            first = key[0] not in self.owners
+            self.owners.setdefault(key[0], set()).add((event, key))
+
+        # Drop the owner's subscriptions when it is closed or collected
+        closer = owner if owner is not None else widget
+        if closer is None or not first: return
+        finalize(closer, self.unsubscribe_id, key[0])
+        if isinstance(closer, Widget): closer.observe(self.closed_callback, names='comm')   # Set to None on close
+
+    def closed_callback(self, change):
+        if change['new'] is None: self.unsubscribe(change['owner'])
+
+    def unsubscribe(self, widget):
+        """Remove every subscription of the widget"""
+        self.unsubscribe_id(id(widget))
+
+    def unsubscribe_id(self, owner_id):
+        with self.lock:
+            for event, key in self.owners.pop(owner_id, ()): self.callbacks[event].pop(key, None)
+
+    def dispatch(self, event, data=None):
+        """Call each live subscriber of the event, dropping those whose widgets have been collected"""
+        with self.lock: subscribers = list(self.callbacks.get(event, {}).items())
+        for key, reference in subscribers:
+            callback = reference() if isinstance(reference, WeakMethod) else reference
+            if callback is None: self.unsubscribe_id(key[0])
+            else: callback(data=data)
+
+    def count(self, event=None):
+        """Return the number of subscriptions to the event, or to every event"""
+        with self.lock:
+            if event is not None: return len(self.callbacks.get(event, {}))
+            return sum(len(callbacks) for callbacks in self.callbacks.values())
+
+
+"""
+Event Subscriptions Singleton
+"""
+subscriptions = Subscriptions()
@@ -0,0 +1,169 @@
+from nbtools import python_safe
+
+
+def fork(node):
+    """Copy the dicts of a parameter sub-tree that expansion annotates, sharing all other values with the original"""
+    copy = dict(node)
+    if isinstance(node.get('inputs'), list): copy['inputs'] = [fork(p) for p in node['inputs']]
+    if isinstance(node.get('cases'), list): copy['cases'] = [fork(c) for c in node['cases']]
+    if isinstance(node.get('test_param'), dict): copy['test_param'] = dict(node['test_param'])
+    if isinstance(node.get('cache'), list): copy['cache'] = [[fork(p) for p in inputs] for inputs in node['cache']]
+    return copy
+
+
+class ToolExpansion:
+    """Flattens a Galaxy tool's nested inputs into nbtools parameter groups and a flat list of parameters"""
+
+    def __init__(self, tool_json):
+        self.tool_json = tool_json
+        self.instances = {}     # Map of (repeat id, index, source id) -> (source inputs, copied inputs for the instance)
+        self.expanded = {}      # Map of id(node) -> (node, group entries, parameters, selectors) of its last expansion
+
+    def expand(self, initial_spec=None):
+        """
+        Return the parameter groups and flat parameter list, using initial_spec to select conditionals and repeats.
+        Sections, conditionals, repeats and repeat instances are expanded again only if the value of a conditional
+        test or repeat count within them has changed, so the rest of the tree is reused from the last expansion.
+        """
+        groups, params, _ = self.expand_node(self.tool_json, True, initial_spec or {})
+        return groups, params
+
+    def reuse(self, node, initial_spec):
+        """Return the node's last expansion if the values of the selectors within it are unchanged, otherwise None"""
+        entry = self.expanded.get(id(node))
+        if entry is None or entry[0] is not node: return None
+        for py_name, (count, value) in entry[3].items():
+            if py_name in initial_spec and (int(initial_spec[py_name]) if count else initial_spec[py_name]) != value:
+                return None
+        return entry[1:]
+
+    def remember(self, node, entries, params, selectors):
+        self.expanded[id(node)] = (node, entries, params, selectors)
+        return entries, params, selectors
+
+    def repeat_inputs(self, repeat, i):
+        """Return the inputs of a repeat's i-th instance, copied once and reused while the tool JSON is unchanged"""
+        cache = repeat.get('cache')
+        source = cache[i] if cache and len(cache) > i else repeat['inputs']
+        key = (id(repeat), i, id(source))
+        if key not in self.instances: self.instances[key] = (source, [fork(p) for p in source])
+        return self.instances[key][1]
+
+    def expand_node(self, input, top_level, initial_spec):
+        """
+        Return the node's group, its flat parameter list and its selectors, a map of the python name of each
+        conditional test and repeat within it -> (whether it is a repeat count, the value it was expanded with)
+        """
+        if not input.get('inputs'): input['inputs'] = []
+
+        # Assemble the group object and empty parameters
+        group = {
+            'name': input.get('label', input.get('title', input.get('name', ''))),
+            'description': input.get('description', ''),
+            'hidden': not input.get('expanded', True),
+            'parameters': []
+        }
+        all_params = []
+        selectors = {}
+        parent = None if top_level else input.get('galaxy_name')
+
+        for p in input['inputs']:
+            if p['type'] in ('section', 'conditional', 'repeat'):
+                p['galaxy_name'] = f"{parent}|{p['name']}" if parent else p['name']
+                p['py_name'] = python_safe(p['galaxy_name'])
+                entries, params, p_selectors = self.reuse(p, initial_spec) or self.expand_complex(p, initial_spec)
+                group['parameters'].extend(entries)             # Add groups to group structure
+                all_params.extend(params)                       # Add params to the flat list
+                selectors.update(p_selectors)
+
+            else:
+                if not p.get('galaxy_name'): p['galaxy_name'] = f"{parent}|{p['name']}" if parent else p['name']
+                if not p.get('py_name'): p['py_name'] = python_safe(p['galaxy_name'])
+                group['parameters'].append(p['py_name'])        # Add param name to group structure
+                all_params.append(p)                            # Add param to the flat list
+
+        return group['parameters'] if top_level else group, all_params, selectors
+
+    def expand_complex(self, p, initial_spec):
+        """Expand a section, conditional or repeat, returning its group entries, parameters and selectors"""
+        if p['type'] == 'section':
+            section_group, section_params, selectors = self.expand_node(p, False, initial_spec)
+            return self.remember(p, [section_group], section_params, selectors)
+
+        if p['type'] == 'conditional':
+            conditional_group, conditional_params, selectors = self.expand_conditional(p, initial_spec)
+            return self.remember(p, [conditional_group], conditional_params, selectors)
+
+        # Add number parameter for repeat sections
+        if 'title' in p and 'label' not in p: p['label'] = f"Number of {p['title']}"
+        entries, repeat_params = [p['py_name']], [p]
+        if 'inputs' not in p: return self.remember(p, entries, repeat_params, {})
+
+        # Merge repeat values, if overridden
+        if p['py_name'] in initial_spec: p['value'] = int(initial_spec[p['py_name']])
+        selectors = {p['py_name']: (True, p.get('value', p['default']))}
+
+        # Add group N times, where N is the number of repeats
+        for i in range(p.get('value', p['default'])):
+            repeat_group, instance_params, instance_selectors = self.expand_repeat(p, i, initial_spec)
+            entries.append(repeat_group)
+            repeat_params.extend(instance_params)
+            selectors.update(instance_selectors)
+        return self.remember(p, entries, repeat_params, selectors)
+
+    def expand_conditional(self, p, initial_spec):
+        # Base group object - conditional_params will always be blank at this point
+        conditional_group, conditional_params, selectors = self.expand_node(p, False, initial_spec)
+
+        # Rename the group based on the test parameter's name - conditional params never have a nice label
+        test_param = p['test_param']
+        conditional_group['name'] = test_param.get('label', test_param.get('title', test_param.get('name', '')))
+        if not conditional_group['name']: conditional_group['name'] = test_param.get('name', 'Select')
+
+        # Add the test param and add conditional_test flag
+        test_param['galaxy_name'] = f"{p['galaxy_name']}|{test_param['name']}"
+        test_param['py_name'] = python_safe(test_param['galaxy_name'])
+        test_param['conditional_test'] = True
+        conditional_group['parameters'].append(test_param['py_name'])
+        conditional_params.append(test_param)
+
+        # If the test param value is overridden, set new value
+        if test_param['py_name'] in initial_spec: test_param['value'] = initial_spec[test_param['py_name']]
+        selectors[test_param['py_name']] = (False, test_param['value'])
+
+        # Add the params of the selected case
+        for case in p['cases']:
+            case['galaxy_name'] = p['galaxy_name']
+            case['py_name'] = p['py_name']
+            if case['value'] != test_param['value']: continue
+
+            for cp in case['inputs']:
+                cp['galaxy_name'] = f"{p['galaxy_name']}|{cp['name']}"
+                cp['py_name'] = python_safe(f"{cp['galaxy_name']}_{case['value']}")
+                cp['conditional_display'] = case['value']           # Save display/submit conditions
+                cp['conditional_param'] = test_param['name']        # Save name of test param
+                cp['hidden'] = False
+            case_group, case_params, case_selectors = self.expand_node(case, False, initial_spec)
+            conditional_group['parameters'].extend(case_group['parameters'])
+            conditional_params.extend(case_params)
+            selectors.update(case_selectors)
+
+        return conditional_group, conditional_params, selectors
+
+    def expand_repeat(self, p, i, initial_spec):
+        # Reuse the instance's last expansion, keyed by its copy of the inputs, unless a selector within it changed
+        inputs = self.repeat_inputs(p, i)
+        reused = self.reuse(inputs, initial_spec)
+        if reused: return reused[0][0], reused[1], reused[2]
+
+        # Share the repeat's values, but give each instance its own copy of the inputs it annotates
+        p_repeat = dict(p)
+        p_repeat['inputs'] = inputs
+        p_repeat['galaxy_name'] = f"{p['galaxy_name']}_{i}"
+        p_repeat['py_name'] = p['py_name']
+        for rp in p_repeat['inputs']:
+            rp['galaxy_name'] = f"{p_repeat['galaxy_name']}|{rp['name']}"
+            rp['py_name'] = python_safe(rp['galaxy_name'])
+        repeat_group, repeat_params, selectors = self.expand_node(p_repeat, False, initial_spec)
+        self.remember(inputs, [repeat_group], repeat_params, selectors)
+        return repeat_group, repeat_params, selectors
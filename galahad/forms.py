@@ -0,0 +1,165 @@
+import json
+from collections import OrderedDict
+from threading import Lock, Timer
+from nbtools import EventManager, UIBuilder
+from nbtools.basewidget import BaseWidget
+from nbtools.form import InteractiveForm, FileFormInput, SelectFormInput, MultiselectFormInput
+from nbtools.uibuilder import UIBuilderBase
+
+PATCHABLE_KEYS = {'name', 'description', 'default', 'choices'}   # Spec keys which can change without a new widget
+
+
+class BuildCache:
+    """LRU cache of Galaxy tools.build responses, bounded by both entry count and total size"""
+
+    def __init__(self, max_entries=64, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()    # Map of key -> serialized tool JSON, least recently used first
+        self.size = 0                   # Total length of the serialized entries
+        self.lock = Lock()
+
+    @staticmethod
+    def key(gi, tool_id, tool_version, history_id, inputs):
+        """Return the cache key for a build request, canonicalizing the inputs"""
+        canonical = json.dumps(inputs, sort_keys=True, default=str) if inputs else None
+        return gi.gi.url, tool_id, tool_version, history_id, canonical
+
+    def get(self, key):
+        """Return a fresh copy of the cached tool JSON, None if not cached"""
+        with self.lock:
+            serialized = self.entries.get(key)
+            if serialized is None: return None
+            self.entries.move_to_end(key)
+        return json.loads(serialized)  # Callers annotate the tool JSON in place, so never share it
+
+    def put(self, key, tool_json):
+        """Cache the tool JSON, evicting the least recently used entries to stay within the limits"""
+        serialized = json.dumps(tool_json)
+        if len(serialized) > self.max_bytes: return
+        with self.lock:
+            if key in self.entries: self.size -= len(self.entries.pop(key))
+            self.entries[key] = serialized
+            self.size += len(serialized)
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def invalidate(self, server=None):
+        """Remove all cached builds for the given server's API URL, or everything if no server is given"""
+        with self.lock:
+            for key in [k for k in self.entries if server is None or k[0] == server]:
+                self.size -= len(self.entries.pop(key))
+
+    def history_callback(self, data):
+        """Data parameter options depend on history contents, so drop the session's builds when they change"""
+        session = data.get('session') if isinstance(data, dict) else None
+        self.invalidate(session.gi.url if session is not None else None)
+
+
+"""
+Tool Build Cache Singleton
+"""
+build_cache = BuildCache()
+EventManager.instance().register("galaxy.history_refresh", build_cache.history_callback)
+
+
+def build_tool(gi, tool_id, history_id, tool_version=None, inputs=None):
+    """Return the tools.build model for the given tool and inputs, serving repeated requests from the cache"""
+    key = BuildCache.key(gi, tool_id, tool_version, history_id, inputs)
+    tool_json = build_cache.get(key)
+    if tool_json is None:
+        tool_json = gi.gi.tools.build(tool_id=tool_id, history_id=history_id, tool_version=tool_version, inputs=inputs)
+        build_cache.put(key, tool_json)
+    return tool_json
+
+
+class ReusingForm(InteractiveForm):
+    """An InteractiveForm which takes the given existing input widgets instead of creating new ones"""
+
+    def __init__(self, function_or_method, parameter_specs, reuse=None, **kwargs):
+        self.reuse = reuse or {}    # Map of parameter name -> widget from the previous form
+        InteractiveForm.__init__(self, function_or_method, parameter_specs, **kwargs)
+
+    def widget_from_spec(self, spec):
+        widget = self.reuse.get(spec['name'])
+        if widget is None: return InteractiveForm.widget_from_spec(self, spec)
+        if isinstance(widget, FileFormInput): widget.input.parent = self.parent    # Show upload progress on this form
+        return widget
+
+
+class ReusingBuilder(UIBuilderBase):
+    """A UIBuilderBase whose form reuses the unchanged input widgets of the form it replaces"""
+
+    def __init__(self, function_or_method, reuse=None, **kwargs):
+        # Mirrors UIBuilderBase.__init__, which offers no way to supply the form's widgets
+        self._apply_defaults(function_or_method)
+        self.function_or_method = function_or_method
+        self._parent = kwargs['_parent'] if '_parent' in kwargs else None
+        BaseWidget.__init__(self, **kwargs)
+        if not self.parameters: self.parameters = self.parameters
+        self.form = ReusingForm(function_or_method, self.parameters, reuse=reuse, parent=self,
+                                upload_callback=self.upload_callback)
+        self.output = self.form.out
+        self.load = lambda **override_kwargs: UIBuilder(self.function_or_method, **{**kwargs, **override_kwargs})
+
+
+def widget_kind(spec):
+    """Return the properties which decide the class of input widget InteractiveForm creates for a spec"""
+    return spec.get('type'), InteractiveForm.is_combo(spec), InteractiveForm.is_multiple(spec)
+
+
+def patchable(widget, old_spec, new_spec):
+    """Return whether an input widget can be updated in place from the old parameter spec to the new one"""
+    changed = {k for k in old_spec.keys() | new_spec.keys() if old_spec.get(k) != new_spec.get(k)}
+    if not changed <= PATCHABLE_KEYS or widget_kind(old_spec) != widget_kind(new_spec): return False
+    return 'choices' not in changed or isinstance(widget, (SelectFormInput, MultiselectFormInput))
+
+
+def patch_widget(widget, form_spec):
+    """Update an input widget in place to match its new nbtools parameter spec"""
+    if isinstance(widget, (SelectFormInput, MultiselectFormInput)): widget.input.options = form_spec['choices']
+    widget.__class__.apply_spec(widget, dict(form_spec))    # apply_spec may delete the default from the spec
+
+
+class Debouncer:
+    """Coalesces form refreshes requested in quick succession into one, so that newer requests supersede older ones"""
+    delay = 0.3     # Seconds to wait for further changes before refreshing
+
+    def __init__(self, refresh):
+        self.refresh = refresh          # Called as refresh(overrides, query_galaxy, generation) on the timer thread,
+                                        # which must call done(generation) once the refresh has been applied
+        self.pending = None             # Overrides merged from the requests waiting on the timer
+        self.query_galaxy = False       # Whether any waiting request needs a new tools.build
+        self.in_flight = ({}, False)    # Overrides and query flag of the refresh running now, merged into newer ones
+        self.generation = 0             # Incremented by every request, refreshes of older generations are stale
+        self.timer = None
+        self.lock = Lock()
+
+    def request(self, overrides, query_galaxy=True):
+        """Schedule a refresh once no further requests have arrived for the delay, superseding any in flight"""
+        with self.lock:
+            self.pending = {**self.in_flight[0], **(self.pending or {}), **overrides}
+            self.query_galaxy = self.query_galaxy or query_galaxy or self.in_flight[1]
+            self.generation += 1
+            if self.timer: self.timer.cancel()
+            self.timer = Timer(self.delay, self.fire)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def fire(self):
+        with self.lock:
+            if self.pending is None: return     # Already taken by a refresh which fired as this one was requested
+            overrides, query_galaxy, generation = self.pending, self.query_galaxy, self.generation
+            self.pending, self.query_galaxy, self.timer = None, False, None
+            self.in_flight = (overrides, query_galaxy)
+        self.refresh(overrides, query_galaxy, generation)
+
+    def done(self, generation):
+        """Mark the refresh of the given generation as applied or failed, so newer requests no longer include it"""
+        with self.lock:
+            if generation == self.generation: self.in_flight = ({}, False)
+
+    def is_stale(self, generation):
+        """Return whether a newer refresh has been requested since the given generation"""
+        return generation is not None and generation != self.generation
@@ -1,5 +1,8 @@
+from threading import Thread
 from bioblend.galaxy.objects import History
-from nbtools import UIOutput, EventManager
+from nbtools import UIOutput
+from .downloads import HistoryDownload, safe_file_name
+from .hydration import hydrator
 from .sessions import session
 from .utils import session_color, GALAXY_LOGO, server_name, galaxy_url, data_name
 
@@ -16,8 +19,8 @@ class GalaxyHistoryWidget(UIOutput):
         UIOutput.__init__(self, origin=self.history_origin(), **kwargs)
         self.poll()  # Query the Galaxy server and begin polling, if needed
 
-        # Register the event handler for Galaxy login
-        EventManager.instance().register("galaxy.login", self.login_callback)
+        # Register the event handler for Galaxy login, which is called once every widget's history is resolved
+        hydrator.track(self, 'history')
 
     def set_color(self, kwargs={}):
         # If color is already set, keep that color
@@ -51,6 +54,15 @@ class GalaxyHistoryWidget(UIOutput):
             self.description = self.history.wrapped['annotation'] if 'annotation' in self.history.wrapped and self.history.wrapped['annotation'] else ''
             self.files = self.files_list()
 
+            # Add the history-level menu items
+            self.extra_menu_items = {
+                **self.extra_menu_items,
+                **{'Download to Workspace': {
+                    'action': 'method',
+                    'code': 'workspace_download'
+                }}
+            }
+
             # Begin polling if pending or running
             # self.poll_if_needed()
         else:
@@ -64,6 +76,22 @@ class GalaxyHistoryWidget(UIOutput):
         return [(data_name(dataset), data_name(dataset), dataset.wrapped['extension'])
                 for dataset in self.history.content_infos]
 
+    def workspace_download(self, directory=None, select=None):
+        """Download the history's datasets to a workspace directory in the background, showing progress in the widget"""
+        directory = directory or safe_file_name(self.history.name)
+        def report(text): self.info = text
+        download = HistoryDownload(self.history.gi, self.history, directory, select=select, progress=report)
+
+        def run_download():
+            try:
+                summary = download.run()
+                if summary['failed']: self.error = '\n'.join(f'{name}: {e}' for name, e in summary['failed'].items())
+            except Exception as e: self.error = f'Error downloading {self.history.name}: {e}'
+
+        self.error = ''
+        self.info = f'Downloading {self.history.name} to {directory}...'
+        Thread(target=run_download, daemon=True, name='galahad-download').start()
+
     def history_origin(self):
         if self.initialized(): return server_name(galaxy_url(self.history.gi))
         else: return ''
@@ -75,7 +103,7 @@ class GalaxyHistoryWidget(UIOutput):
 
         # Attempt to initialize the dataset
         try:
-            self.history = session.histories.get(self.history)
+            self.history = hydrator.resolved('history', self.history) or session.histories.get(self.history)
             self.error = ''
             self.set_color()
             return True
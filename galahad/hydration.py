@@ -0,0 +1,89 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from weakref import WeakKeyDictionary
+from bioblend import ConnectionError
+from bioblend.galaxy.objects.wrappers import HistoryDatasetAssociation
+from .api import get_history, list_contents
+from .events import subscriptions
+from .stats import timed
+from .utils import current_history
+
+
+class Hydrator:
+    """Resolves the datasets and histories of every widget waiting on a login together, then passes the login on"""
+    max_workers = 4     # Concurrent requests for the datasets and histories not found in the current history
+    page_size = 100     # Most recently updated datasets of the current history to look for the IDs among
+
+    def __init__(self, max_workers=None):
+        self.widgets = WeakKeyDictionary()      # Map of widget -> 'dataset' or 'history', in the order tracked
+        self.wrappers = {}                      # Map of (kind, ID) -> wrapper resolved for the current login
+        self.lock = Lock()
+        self.max_workers = max_workers or self.max_workers
+
+    def track(self, widget, kind):
+        """Call the widget's login_callback after each login, once the IDs of all tracked widgets are resolved"""
+        with self.lock: self.widgets[widget] = kind
+
+    def resolved(self, kind, id):
+        """Return the wrapper resolved for the ID during the current login, None if there isn't one"""
+        with self.lock: return self.wrappers.get((kind, id))
+
+    def login_callback(self, data=None):
+        with self.lock: widgets = [(w, k) for w, k in self.widgets.items() if getattr(w, 'comm', True) is not None]
+        if data is not None: self.hydrate(data, widgets)
+        try:
+            for widget, _ in widgets: widget.login_callback(data)
+        finally:
+            with self.lock: self.wrappers = {}
+
+    @timed('hydrate_widgets')
+    def hydrate(self, session, widgets):
+        """Resolve the unresolved IDs of the widgets in as few requests as possible"""
+        pending = [(k, getattr(w, k)) for w, k in widgets if isinstance(getattr(w, k), str)]    # IDs not yet wrappers
+        dataset_ids = list(dict.fromkeys(i for k, i in pending if k == 'dataset'))
+        history_ids = list(dict.fromkeys(i for k, i in pending if k == 'history'))
+        wrappers = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='galahad-hydrate') as executor:
+            wrappers.update(self.resolve_datasets(session, dataset_ids, executor))
+            histories = executor.map(lambda i: self.fetch(session.histories.get, i), history_ids)
+            wrappers.update({('history', i): h for i, h in zip(history_ids, histories) if h is not None})
+        with self.lock: self.wrappers = wrappers
+
+    def resolve_datasets(self, session, dataset_ids, executor):
+        """Return a map of ('dataset', ID) -> dataset wrapper, for each of the IDs Galaxy returns"""
+        if not dataset_ids: return {}
+        wrappers = {}
+
+        # Outputs are usually the latest datasets in the current history, so look for them in one page of its contents
+        history = self.fetch(current_history, session)
+        page = max(self.page_size, len(dataset_ids))
+        contents = self.fetch(lambda: list_contents(session, history.id, limit=page, deleted=None)) if history else None
+        wanted = set(dataset_ids)
+        for content in contents or []:
+            if content.get('id') in wanted and content.get('history_content_type', 'dataset') == 'dataset':
+                wrappers[('dataset', content['id'])] = HistoryDatasetAssociation(content, container=history, gi=session)
+
+        # Query the rest individually, then each history containing them once
+        remaining = [i for i in dataset_ids if ('dataset', i) not in wrappers]
+        details = [d for d in executor.map(lambda i: self.fetch(session.gi.datasets.show_dataset, i), remaining) if d]
+        container_ids = list({d['history_id'] for d in details if d.get('history_id')})
+        containers = executor.map(lambda i: self.fetch(get_history, session, i), container_ids)
+        containers = {i: h for i, h in zip(container_ids, containers) if h is not None}
+        for d in details:
+            if d.get('history_id') not in containers: continue
+            wrappers[('dataset', d['id'])] = HistoryDatasetAssociation(d, container=containers[d['history_id']],
+                                                                       gi=session)
+        return wrappers
+
+    @staticmethod
+    def fetch(query, *args):
+        """Run a query, None if Galaxy returns an error, leaving the widget to query again and report it"""
+        try: return query(*args)
+        except ConnectionError: return None
+
+
+"""
+Widget Hydration Singleton
+"""
+hydrator = Hydrator()
+subscriptions.subscribe("galaxy.login", hydrator.login_callback)
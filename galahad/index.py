@@ -0,0 +1,97 @@
+from threading import Lock, RLock
+
+
+class DatasetIndex:
+    """The names, IDs and extensions of one history's datasets, shared by every tool widget and updated incrementally"""
+
+    def __init__(self, history_id):
+        self.history_id = history_id
+        self.ids = {}           # Map of display name -> dataset ID, the latest dataset given the name
+        self.choice_names = {}  # Map of dataset ID -> name shown in data parameter choices
+        self.labels = {}        # Map of dataset ID -> data panel label, "hid: name"
+        self.extensions = {}    # Map of dataset ID -> extension
+        self.kinds = {}         # Map of extension -> {dataset ID: None}, in the order added
+        self.lock = RLock()
+
+    def __len__(self):
+        return len(self.choice_names.keys() | self.labels.keys())
+
+    def update(self, contents):
+        """Apply history content dicts, adding or updating datasets and removing deleted ones"""
+        with self.lock:
+            for content in contents:
+                if content.get('history_content_type', 'dataset') != 'dataset': continue
+                if content.get('deleted') or content.get('purged'): self.remove(content['id'])
+                else: self.add(content['id'], label=f'{content.get("hid")}: {content.get("name")}',
+                               extension=content.get('extension'))
+
+    def add_options(self, datasets):
+        """Add the (name, dataset ID) pairs of a data parameter's options"""
+        with self.lock:
+            for name, dataset_id in datasets: self.add(dataset_id, choice_name=name)
+
+    def add(self, dataset_id, choice_name=None, label=None, extension=None):
+        with self.lock:
+            for names, name in ((self.choice_names, choice_name), (self.labels, label)):
+                if name is None: continue
+                if names.get(dataset_id) not in (None, name) and self.ids.get(names[dataset_id]) == dataset_id:
+                    del self.ids[names[dataset_id]]     # Renamed
+                names[dataset_id] = name
+                self.ids[name] = dataset_id
+            if extension is not None and self.extensions.get(dataset_id) != extension:
+                self.kinds.get(self.extensions.get(dataset_id), {}).pop(dataset_id, None)
+                self.extensions[dataset_id] = extension
+                self.kinds.setdefault(extension, {})[dataset_id] = None
+
+    def remove(self, dataset_id):
+        with self.lock:
+            for names in (self.choice_names, self.labels):
+                name = names.pop(dataset_id, None)
+                if name is not None and self.ids.get(name) == dataset_id: del self.ids[name]
+            self.kinds.get(self.extensions.pop(dataset_id, None), {}).pop(dataset_id, None)
+
+    def clear(self):
+        with self.lock: self.ids, self.choice_names, self.labels, self.extensions, self.kinds = {}, {}, {}, {}, {}
+
+    def id(self, name):
+        """Return the ID of the dataset with the choice name or data panel label, None if there isn't one"""
+        with self.lock: return self.ids.get(name)
+
+    def name(self, dataset_id):
+        """Return the name of the dataset shown in choices, or its label if it hasn't been a choice, None if unknown"""
+        with self.lock: return self.choice_names.get(dataset_id) or self.labels.get(dataset_id)
+
+    def of_kinds(self, kinds=None):
+        """Return the IDs of the datasets with any of the extensions, or of every dataset with a known extension"""
+        with self.lock:
+            if not kinds: return list(self.extensions)
+            return [dataset_id for kind in dict.fromkeys(kinds) for dataset_id in self.kinds.get(kind, ())]
+
+    def choices(self, kinds=None):
+        """Return data parameter choices for the datasets with any of the extensions"""
+        with self.lock:
+            names = (self.name(dataset_id) for dataset_id in self.of_kinds(kinds))
+            return {name: name for name in names}
+
+
+_indexes = {}           # Map of session -> {history ID -> DatasetIndex}
+_indexes_lock = Lock()
+
+
+def dataset_index(gi, history_id):
+    """Return the DatasetIndex of the given history of a Galaxy session, creating it if necessary"""
+    with _indexes_lock:
+        histories = _indexes.setdefault(gi, {})
+        if history_id not in histories: histories[history_id] = DatasetIndex(history_id)
+        return histories[history_id]
+
+
+def dataset_indexes(gi, first=None):
+    """Return the session's dataset indexes, that of the given history first"""
+    with _indexes_lock: indexes = list(_indexes.get(gi, {}).values())
+    return sorted(indexes, key=lambda index: index.history_id != first)
+
+
+def discard_indexes(gi):
+    """Discard the dataset indexes of a Galaxy session which is no longer in use"""
+    with _indexes_lock: _indexes.pop(gi, None)
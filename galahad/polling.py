@@ -0,0 +1,223 @@
+import logging
+from random import uniform
+from threading import Lock, RLock, Timer
+from time import monotonic
+from .api import content_pages, history_id, update_wrapper
+from .stats import timed
+
+TERMINAL_STATES = ('ok', 'error', 'deleted', 'discarded', 'failed_metadata')
+
+logger = logging.getLogger(__name__)
+
+
+class PollPolicy:
+    """Exponential backoff schedule used when polling pending datasets"""
+
+    def __init__(self, initial=15.0, factor=1.5, maximum=600.0, jitter=0.1, max_misses=3):
+        """
+        :param initial: seconds before the first poll, and after any change of state
+        :param factor: multiplier applied to the delay after each poll that finds the state unchanged
+        :param maximum: upper bound on the delay between polls, in seconds
+        :param jitter: fraction by which each delay is randomly lengthened or shortened
+        :param max_misses: consecutive polls a dataset may be missing from its history before it is no longer watched
+        """
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+        self.jitter = jitter
+        self.max_misses = max_misses
+
+    def base_delay(self, attempt):
+        """Return the delay before the given poll attempt, without jitter"""
+        return min(self.initial * self.factor ** min(attempt, 64), self.maximum)
+
+    def delay(self, attempt):
+        """Return the delay before the given poll attempt (counting from zero since the last state change)"""
+        return self.base_delay(attempt) * uniform(1 - self.jitter, 1 + self.jitter)
+
+
+"""
+Default polling policy, tune its attributes to change how often all sessions poll Galaxy
+"""
+poll_policy = PollPolicy()
+
+
+class WatchedDataset:
+    """A pending dataset and the (dataset wrapper, callback) pairs subscribed to its state changes"""
+
+    def __init__(self, dataset, policy):
+        self.id = dataset.id
+        self.history_id = history_id(dataset)
+        self.state = dataset.state
+        self.update_time = dataset.wrapped.get('update_time')
+        self.subscriptions = []
+        self.attempts = 0
+        self.misses = 0     # Consecutive polls which found the dataset missing from its history
+        self.due = monotonic() + policy.delay(0)
+
+    def subscribe(self, dataset, callback):
+        """Add a subscription, ignoring duplicates of one already registered"""
+        for d, c in self.subscriptions:
+            if d is dataset and c == callback: return
+        self.subscriptions.append((dataset, callback))
+
+    def backoff(self, policy, state_changed):
+        """Schedule the next poll, resetting the backoff if the state has changed"""
+        self.attempts = 0 if state_changed else self.attempts + 1
+        self.due = monotonic() + policy.delay(self.attempts)
+
+
+class StatePoller:
+    """Polls the state of every pending dataset in a Galaxy session, using one contents query per history"""
+    page_size = 500     # Datasets per contents query, more are fetched only if that many have been updated
+
+    def __init__(self, gi, policy=None):
+        self.gi = gi
+        self.policy = policy            # Use the module's poll_policy if None
+        self.watched = {}               # Map of dataset ID -> WatchedDataset
+        self.lock = RLock()
+        self.timer = None
+        self.next_tick = None
+        self.stopped = False
+        self.stats = {'requests': 0, 'datasets_polled': 0, 'polls_saved': 0}
+
+    def current_policy(self):
+        return self.policy or poll_policy
+
+    def watch(self, dataset, callback=None):
+        """Track the dataset until it reaches a terminal state, calling callback(dataset) on each state change"""
+        if dataset.state in TERMINAL_STATES: return
+        with self.lock:
+            if self.stopped: return
+            if dataset.id not in self.watched: self.watched[dataset.id] = WatchedDataset(dataset, self.current_policy())
+            self.watched[dataset.id].subscribe(dataset, callback)
+            self.schedule()
+
+    def unwatch(self, dataset_id):
+        """Stop tracking the dataset with the given ID"""
+        with self.lock: self.watched.pop(dataset_id, None)
+
+    def schedule(self):
+        """Set the timer for when the next watched dataset is due, if that is sooner than the pending tick"""
+        with self.lock:
+            if self.stopped or not self.watched: return
+            due = min(w.due for w in self.watched.values())
+            if self.timer is not None:
+                if due >= self.next_tick: return
+                self.timer.cancel()
+            self.next_tick = due
+            self.timer = Timer(max(due - monotonic(), 0), self.tick)
+            self.timer.daemon = True
+            self.timer.start()
+
+    @timed('poll_tick')
+    def tick(self):
+        """Refresh all due datasets in bulk and dispatch any state changes"""
+        policy = self.current_policy()
+        with self.lock:
+            self.timer = None
+            horizon = monotonic() + policy.initial   # Poll datasets due soon early, so that queries are batched
+            by_history = {}
+            for watched in self.watched.values():
+                if watched.due <= horizon: by_history.setdefault(watched.history_id, []).append(watched)
+
+        for h_id, due in by_history.items():
+            try:
+                if h_id: pages = list(self.updated_contents(h_id, due))
+                else: pages = [[self.gi.gi.datasets.show_dataset(w.id) for w in due]]  # History unknown, query singly
+            except Exception: pages = None  # Galaxy unreachable, back off and try again
+            self.count(policy, due, max(len(pages or ()), 1) if h_id else len(due))
+
+            contents = [content for page in pages or () for content in page]
+            changed = {content.get('id') for content in contents if self.apply(content)}
+            found = {content.get('id') for content in contents}
+            with self.lock:
+                for watched in due:
+                    watched.backoff(policy, watched.id in changed)
+                    if pages is not None: self.miss(policy, watched, watched.id in found)
+
+        self.schedule()
+
+    def updated_contents(self, h_id, due):
+        """
+        Yield pages of every dataset in the history updated since the earliest of the due datasets was last seen.
+        Every due dataset still in the history is included, as its update time is at or after that one, deleted too.
+        """
+        times = [w.update_time for w in due]
+        since = None if None in times else min(times)
+        return content_pages(self.gi, h_id, 'update_time', descending=False, bound=since, page_size=self.page_size,
+                             deleted=None)
+
+    def miss(self, policy, watched, found):
+        """Count the polls which haven't found the dataset, no longer watching it once it has been missing too long"""
+        watched.misses = 0 if found else watched.misses + 1
+        if watched.misses >= policy.max_misses: self.watched.pop(watched.id, None)
+
+    def count(self, policy, due, requests):
+        """Update the counters, comparing against one request per dataset every policy.initial seconds"""
+        baseline = sum(max(1, round(policy.base_delay(w.attempts) / policy.initial)) for w in due)
+        with self.lock:
+            self.stats['requests'] += requests
+            self.stats['datasets_polled'] += len(due)
+            self.stats['polls_saved'] += baseline - requests
+
+    def apply(self, content):
+        """Apply a queried content dict to the matching watched dataset, return whether its state changed"""
+        if content.get('deleted') or content.get('purged'): content = {**content, 'state': 'deleted'}  # Terminal
+        with self.lock:
+            watched = self.watched.get(content.get('id'))
+            if watched is None or content.get('state') == watched.state: return False
+            watched.state = content.get('state')
+            watched.update_time = content.get('update_time') or watched.update_time
+            if watched.state in TERMINAL_STATES: del self.watched[watched.id]
+            subscriptions = list(watched.subscriptions)
+
+        for dataset, callback in subscriptions:
+            update_wrapper(dataset, content)
+            if callback is None: continue
+            try: callback(dataset)
+            except Exception as e: self.report(callback, f'Error updating Galaxy dataset {watched.id}: {e}')
+        return True
+
+    @staticmethod
+    def report(callback, message):
+        """Display an error in the widget whose callback raised it, or log it if the callback isn't a widget's"""
+        widget = getattr(callback, '__self__', None)
+        if hasattr(widget, 'error'): widget.error = message
+        else: logger.warning(message)
+
+    def stop(self):
+        """Cancel any pending tick and stop tracking all datasets"""
+        with self.lock:
+            self.stopped = True
+            if self.timer is not None: self.timer.cancel()
+            self.timer = None
+            self.watched.clear()
+
+
+_pollers = {}           # Map of session -> StatePoller
+_pollers_lock = Lock()
+
+
+def poller(gi):
+    """Return the StatePoller for the given Galaxy session, creating it if necessary"""
+    with _pollers_lock:
+        if gi not in _pollers: _pollers[gi] = StatePoller(gi)
+        return _pollers[gi]
+
+
+def stop_polling(gi):
+    """Stop and discard the StatePoller for the given Galaxy session, if one exists"""
+    with _pollers_lock: state_poller = _pollers.pop(gi, None)
+    if state_poller: state_poller.stop()
+
+
+def poll_stats():
+    """Return the polling counters summed over all active sessions, plus the number of datasets being watched"""
+    with _pollers_lock: pollers = list(_pollers.values())
+    totals = {'requests': 0, 'datasets_polled': 0, 'polls_saved': 0, 'watching': 0}
+    for p in pollers:
+        with p.lock:
+            for k, v in p.stats.items(): totals[k] += v
+            totals['watching'] += len(p.watched)
+    return totals
@@ -0,0 +1,178 @@
+import gzip
+import io
+import pandas as pd
+from .downloads import DatasetDownload, dataset_cache, download_url
+from .sessions import session
+from .transport import attach_transport
+
+BED_COLUMNS = ['chrom', 'chromStart', 'chromEnd', 'name', 'score', 'strand', 'thickStart', 'thickEnd', 'itemRgb',
+               'blockCount', 'blockSizes', 'blockStarts']
+GFF_COLUMNS = ['seqid', 'source', 'type', 'start', 'end', 'score', 'strand', 'phase', 'attributes']
+GALAXY_DTYPES = {'int': 'Int64', 'float': 'float64', 'str': 'string', 'list': 'string'}   # Galaxy column type -> pandas
+
+FORMATS = {     # Map of Galaxy extension -> separator, prefixes of header lines, and known column names and types
+    'csv': {'sep': ',', 'skip': ('#',)},
+    'tsv': {'sep': '\t', 'skip': ('#',)},
+    'tabular': {'sep': '\t', 'skip': ('#',)},
+    'interval': {'sep': '\t', 'skip': ('#', 'track', 'browser')},
+    'bed': {'sep': '\t', 'skip': ('#', 'track', 'browser'), 'names': BED_COLUMNS,
+            'dtype': {'chrom': 'string', 'chromStart': 'Int64', 'chromEnd': 'Int64', 'strand': 'string'}},
+    'bedgraph': {'sep': '\t', 'skip': ('#', 'track', 'browser'), 'names': ['chrom', 'chromStart', 'chromEnd', 'value'],
+                 'dtype': {'chrom': 'string', 'chromStart': 'Int64', 'chromEnd': 'Int64', 'value': 'float64'}},
+    'gff': {'sep': '\t', 'skip': ('#',), 'names': GFF_COLUMNS, 'dtype': {'seqid': 'string', 'start': 'Int64', 'end': 'Int64'}},
+    'vcf': {'sep': '\t', 'skip': ('##',), 'header': '#',
+            'dtype': {'CHROM': 'string', 'POS': 'Int64', 'ID': 'string', 'REF': 'string', 'ALT': 'string'}},
+}
+ALIASES = {'bed6': 'bed', 'bed12': 'bed', 'bedstrict': 'bed', 'encodepeak': 'bed', 'gff3': 'gff', 'gtf': 'gff',
+           'txt': 'tabular', 'vcf_bgzip': 'vcf', 'csv.gz': 'csv', 'tabular.gz': 'tabular', 'bed.gz': 'bed',
+           'vcf.gz': 'vcf'}
+
+
+def data_format(ext):
+    """Return how to parse a dataset of the given extension, as Galaxy tabular if it isn't one of the known formats"""
+    ext = (ext or '').lower()
+    return FORMATS.get(ALIASES.get(ext, ext), FORMATS['tabular'])
+
+
+def compressed(ext):
+    return (ext or '').endswith('.gz') or ext == 'vcf_bgzip'
+
+
+class Prepended(io.TextIOBase):
+    """A text stream which reads the given line before the rest of the stream, to return a line already consumed"""
+
+    def __init__(self, head, stream):
+        self.head = head
+        self.stream = stream
+
+    def readable(self): return True
+
+    def read(self, size=-1):
+        if not self.head: return self.stream.read(size)
+        if size is None or size < 0: text, self.head = self.head + self.stream.read(), ''
+        else: text, self.head = self.head[:size], self.head[size:]
+        return text
+
+    def readline(self, size=-1):
+        if not self.head: return self.stream.readline(size)
+        line, self.head = self.head, ''
+        return line
+
+
+def read_header(lines, fmt):
+    """Read the lines before a dataset's first data line, return (header lines read, column names, first data line)"""
+    count, names = 0, None
+    for line in lines:
+        if fmt.get('header') and line.startswith(fmt['header']) and not line.startswith(fmt['skip']):
+            names = line[len(fmt['header']):].rstrip('\r\n').split(fmt['sep'])     # VCF #CHROM line
+        elif not line.startswith(fmt['skip']): return count, names, line
+        elif line.startswith('#') and len(line) > 1: names = line[1:].rstrip('\r\n').split(fmt['sep'])
+        count += 1
+    return count, names, ''
+
+
+def column_spec(fmt, details, header_names, first_line):
+    """Return the column names and pandas dtypes of a dataset, from Galaxy's metadata and what its format specifies"""
+    metadata_names = details.get('metadata_column_names') or []
+    metadata_types = details.get('metadata_column_types') or []
+    columns = len(first_line.split(fmt['sep'])) if first_line else len(metadata_types)
+
+    # Prefer names Galaxy has recorded, then those of the format, then any header line with the right number of fields
+    names = None
+    if len(metadata_names) == columns and columns: names = list(metadata_names)
+    elif fmt.get('names') and columns <= len(fmt['names']): names = fmt['names'][:columns]
+    elif header_names and len(header_names) == columns: names = header_names
+    if not names: names = list(range(columns))
+
+    dtype = {name: GALAXY_DTYPES[t] for name, t in zip(names, metadata_types) if t in GALAXY_DTYPES}
+    dtype.update({k: v for k, v in fmt.get('dtype', {}).items() if k in names})
+    return names, dtype
+
+
+def dataset_details(dataset):
+    return dataset.gi.gi.datasets.show_dataset(dataset.id)
+
+
+def read_dataset(dataset, nrows=None, byte_range=None, cache=False, **kwargs):
+    """
+    Read a tabular dataset straight from Galaxy into a pandas DataFrame, without saving it to the workspace
+    :param dataset: a bioblend dataset wrapper, or the ID of a dataset in the current session
+    :param nrows: read only the first nrows data lines, stopping the transfer once they have arrived
+    :param byte_range: (start, stop) of the bytes to read, trimmed to whole lines, uses the column names Galaxy recorded
+                       and is not supported for compressed datasets, whose bytes don't split into lines
+    :param cache: copy the whole dataset into the local cache if it isn't there, and memory map it from there
+    :param kwargs: passed on to pandas.read_csv, overriding the separator, names and dtypes chosen for the format
+    :return: the DataFrame, whose to_numpy() gives a NumPy array
+    """
+    if isinstance(dataset, str): dataset = session.get(0).datasets.get(dataset)
+    details = dataset_details(dataset)
+    ext = details.get('file_ext') or details.get('extension')
+    fmt = data_format(ext)
+    if byte_range and compressed(ext): raise ValueError(f'Cannot read a byte range of a compressed ({ext}) dataset')
+
+    # Read from the local cache if the dataset is there, or if asked to put it there
+    path = dataset_cache.fetch(dataset, details) if cache and dataset_cache.cacheable(details) else \
+        dataset_cache.lookup(dataset.gi, details)
+    if path and byte_range: return read_range(path, details, fmt, byte_range, **kwargs)
+    if path: return read_cached(path, details, fmt, nrows, **kwargs)
+    if byte_range: return read_range(dataset, details, fmt, byte_range, **kwargs)
+
+    gi = dataset.gi
+    with attach_transport(gi).get(download_url(gi, details), stream=True, headers=gi.gi.json_headers) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True     # Undo any compression applied in transit
+        r.raw.auto_close = False        # The text wrapper reads on after the end, which fails if the stream closes
+        binary = gzip.GzipFile(fileobj=r.raw) if compressed(ext) else r.raw
+        lines = io.TextIOWrapper(binary, encoding='utf-8', errors='replace', newline='')
+        _, header_names, first_line = read_header(lines, fmt)
+        if not first_line: return pd.DataFrame()
+        names, dtype = column_spec(fmt, details, header_names, first_line)
+        options = {'sep': fmt['sep'], 'header': None, 'names': names, 'dtype': dtype, 'nrows': nrows, **kwargs}
+        return pd.read_csv(Prepended(first_line, lines), **options)
+
+
+def read_range(source, details, fmt, byte_range, **kwargs):
+    """Read the whole lines within a range of a dataset's bytes, from Galaxy or from the dataset's cached file"""
+    start, stop = byte_range
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            f.seek(start)
+            content = f.read(stop - start)
+    else:
+        gi = source.gi
+        headers = {**gi.gi.json_headers, 'Range': f'bytes={start}-{stop - 1}'}
+        with attach_transport(gi).get(download_url(gi, details), stream=True, headers=headers) as r:
+            r.raise_for_status()
+            if r.status_code == 206: content = r.content
+            else: content = read_until(r, stop)[start:stop]     # The server ignored the range, and sent every byte
+
+    # Drop the partial lines at either end, and any header lines at the start of the file
+    if start > 0: content = content[content.find(b'\n') + 1:] if b'\n' in content else b''
+    if details.get('file_size') is None or stop < details['file_size']: content = content[:content.rfind(b'\n') + 1]
+    lines = io.StringIO(content.decode('utf-8', errors='replace'), newline='')
+    _, header_names, first_line = read_header(lines, fmt)
+    if not first_line: return pd.DataFrame()
+    names, dtype = column_spec(fmt, details, header_names, first_line)
+    options = {'sep': fmt['sep'], 'header': None, 'names': names, 'dtype': dtype, **kwargs}
+    return pd.read_csv(Prepended(first_line, lines), **options)
+
+
+def read_until(response, stop):
+    """Return the first stop bytes of a streamed response, closing it without transferring the rest"""
+    content = bytearray()
+    for chunk in response.iter_content(chunk_size=DatasetDownload.chunk_size):
+        content += chunk
+        if len(content) >= stop: break
+    return bytes(content)
+
+
+def read_cached(path, details, fmt, nrows=None, **kwargs):
+    """Read a dataset from its cached file, whose name has no extension for pandas to infer compression from"""
+    ext = details.get('file_ext') or details.get('extension')
+    with (gzip.open(path, 'rt', newline='') if compressed(ext) else open(path, newline='')) as lines:
+        skip, header_names, first_line = read_header(lines, fmt)
+    if not first_line: return pd.DataFrame()
+    names, dtype = column_spec(fmt, details, header_names, first_line)
+    options = {'sep': fmt['sep'], 'header': None, 'names': names, 'dtype': dtype, 'nrows': nrows, 'skiprows': skip,
+               'memory_map': not compressed(ext), 'compression': 'gzip' if compressed(ext) else None, **kwargs}
+    return pd.read_csv(path, **options)
@@ -1,73 +1,156 @@
+from hashlib import sha1
+from threading import RLock
+from urllib.parse import urlsplit, urlunsplit
+from .index import discard_indexes
+from .polling import stop_polling
+from .transport import attach_transport, detach_transport
+
+
 class SessionList:
-    """ Keeps a list of all currently registered Galaxy sessions """
-    sessions = []
+    """ Keeps a list of all currently registered Galaxy sessions, indexed by server url and user """
+
+    def __init__(self):
+        self.sessions = []      # Sessions in order of registration, used for lookups by index
+        self.index = {}         # Map of (normalized url, user) -> session
+        self.by_url = {}        # Map of normalized url -> list of users, most recently registered last
+        self.lock = RLock()     # Sessions are read from poll and login threads
 
     def register(self, session):
         """
         Register a new GalaxyInstance session for the provided server, username and password. Return the session.
+        A session for the same server and user replaces the old one, other users' sessions are kept.
+        The session's API requests are routed through a pooled transport until it is unregistered.
         :param session:
         :return:
         """
+        key = (SessionList.normalize(session.gi.url), SessionList.user(session))
+        with self.lock:
+            # Replace old session for the server and user
+            old = self.index.get(key)
+            if old is not None: self.sessions[self.sessions.index(old)] = session
 
-        # Validate that the server is not already registered
-        index = self._get_index(session.gi.url)
-        new_server = index == -1
-
-        # Add the new session to the list
-        if new_server:  self.sessions.append(session)
-
-        # Otherwise, replace old session
-        else: self.sessions[index] = session
+            # Otherwise, add the new session to the list
+            else: self.sessions.append(session)
 
+            self.index[key] = session
+            users = self.by_url.setdefault(key[0], [])
+            if key[1] in users: users.remove(key[1])
+            users.append(key[1])
+        if old is not None and old is not session: SessionList.release(old)
+        attach_transport(session)
         return session
 
-    def get(self, server):
+    def get(self, server, user=None):
         """
         Returns a registered GalaxyInstance object with a matching server url or index
+        If no user is given, returns the most recently registered session for the server
+        Falls back to the first registered server whose url begins with the given prefix
         Returns None if no matching result was found
         :param server:
+        :param user:
         :return:
         """
+        with self.lock:
+            # Handle indexes
+            if isinstance(server, int):
+                if server >= len(self.sessions): return None
+                else: return self.sessions[server]
 
-        # Handle indexes
-        if isinstance(server, int):
-            if server >= len(self.sessions): return None
-            else: return self.sessions[server]
-
-        # Handle server URLs
-        index = self._get_index(server)
-        if index == -1: return None
-        else: return self.sessions[index]
+            # Handle server URLs
+            url = SessionList.normalize(server)
+            if url not in self.by_url: url = self._match_prefix(url)
+            if url is None: return None
+            if user is None: return self.index[(url, self.by_url[url][-1])]
+            else: return self.index.get((url, user))
 
-    def make(self, server):
+    def make(self, server, user=None):
         """
         Returns the registered session, if one exists. Otherwise, returns None
         :param server:
+        :param user:
         :return:
         """
-        session = self.get(server)
+        session = self.get(server, user)
         if session: return session
         elif isinstance(server, int): raise RuntimeError('make() does not support session indexes')
         else: return None
 
+    def unregister(self, server, user=None):
+        """
+        Remove the session with a matching server url or index and release its polling and connections.
+        Returns the removed session, or None if no matching result was found
+        :param server:
+        :param user:
+        :return:
+        """
+        with self.lock:
+            session = self.get(server, user)
+            if session is None: return None
+            url, user = SessionList.normalize(session.gi.url), SessionList.user(session)
+            self.sessions.remove(session)
+            del self.index[(url, user)]
+            self.by_url[url].remove(user)
+            if not self.by_url[url]: del self.by_url[url]
+        SessionList.release(session)
+        return session
+
     def clean(self):
         """
         Clear all sessions from the sessions list
         :return:
         """
-        self.sessions = []
+        with self.lock:
+            sessions = self.sessions
+            self.sessions = []
+            self.index = {}
+            self.by_url = {}
+        for session in sessions: SessionList.release(session)
 
-    def _get_index(self, server_url):
+    @staticmethod
+    def release(session):
         """
-        Returns a registered GalaxyInstance object with a matching server url
-        Returns -1 if no matching result was found
+        Stop polling a removed session's datasets, close its pooled connections and drop its dataset indexes
+        :param session:
+        :return:
+        """
+        stop_polling(session)
+        detach_transport(session)
+        discard_indexes(session)
+
+    def _match_prefix(self, prefix):
+        """
+        Returns the normalized url of the first registered server beginning with the prefix
+        Returns None if no matching result was found
+        :param prefix:
+        :return:
+        """
+        for url in self.by_url:
+            if url.startswith(prefix): return url
+        return None
+
+    @staticmethod
+    def normalize(server_url):
+        """
+        Returns the server url in a canonical form: lowercase host, without the trailing slash or /api path
         :param server_url:
         :return:
         """
-        for i in range(len(self.sessions)):
-            session = self.sessions[i]
-            if session.gi.url.startswith(server_url): return i
-        return -1
+        parts = urlsplit(server_url.strip())
+        path = parts.path.rstrip('/')
+        if path.endswith('/api'): path = path[:-4]
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, '', ''))
+
+    @staticmethod
+    def user(session):
+        """
+        Returns the identity of the user a session is authenticated as: their email, or else a digest of the API key
+        :param session:
+        :return:
+        """
+        email = getattr(session.gi, 'email', None)
+        if email: return email.lower()
+        key = getattr(session.gi, '_key', None) or ''
+        return f'key:{sha1(key.encode("utf-8")).hexdigest()[:12]}'
 
 
 """
@@ -0,0 +1,134 @@
+from nbtools import python_safe
+from .utils import limited_eval
+
+PARAM_TYPES = {                 # Map of Galaxy parameter type -> nbtools parameter type, anything else is text
+    'select': 'choice',
+    'hidden': 'text',
+    'upload_dataset': 'file',
+    'genomebuild': 'choice',
+    'baseurl': 'text',
+    'data': 'file',
+    'text': 'text',
+    'boolean': 'choice',
+    'directory_uri': 'text',
+    'data_collection': 'file',
+    'repeat': 'number',
+    'rules': 'text',
+    'data_column': 'choice',
+    'integer': 'number',
+    'float': 'number',
+    'hidden_data': 'file',
+    'color': 'color',
+    'drill_down': 'choice',
+}
+OVERRIDABLE = ('name', 'default', 'description', 'optional', 'kinds')   # Spec keys users may override by parameter
+SPEC_FIELDS = ('name', 'label', 'value', 'help', 'optional', 'extensions', 'type', 'multiple', 'hidden', 'options',
+               'default', 'py_name')    # Galaxy parameter keys a spec is compiled from
+
+
+def form_value(raw_value):
+    """Give the default parameter value in format the UI Builder expects"""
+    if raw_value is not None: return raw_value
+    else: return ''
+
+
+def value_strings(raw_values):
+    if isinstance(raw_values, dict):
+        if 'values' in raw_values and isinstance(raw_values['values'], list):
+            if not len(raw_values['values']): return []
+            elif 'id' in raw_values['values'][0]:
+                return [v['id'] for v in raw_values['values']]
+    return str(raw_values)
+
+
+def options_spec(options):
+    """Return the choices for a parameter's options, and the (display name, dataset id) pairs of any data options"""
+    if isinstance(options, list): return {c[0]: c[1] for c in options}, ()
+    choices, datasets = {}, []
+    for l in options.values():
+        for i in l:
+            choices[i['name']] = i['name']
+            datasets.append((i['name'], i['id']))
+    return choices, tuple(datasets)
+
+
+class SpecCompiler:
+    """Compiles Galaxy parameters into nbtools parameter specs, reusing the spec of each parameter left unchanged"""
+
+    def __init__(self, param_overrides=None):
+        # Index the user's overrides once, rather than checking them for every attribute of every parameter
+        self.overrides = {name: {k: v for k, v in attrs.items() if k in OVERRIDABLE}
+                          for name, attrs in (param_overrides or {}).items()}
+        self.memo = {}  # Map of python name -> (spec fields, (name, spec, dataset pairs)), for the last compile
+        self.index = None   # DatasetIndex the last compile added data options to
+
+    def compile(self, widget, params):
+        """Return the spec of each parameter, adding the dataset names of new data options to the history's index"""
+        spec, memo = {}, {}
+        index = widget.dataset_index()
+        reseed = index is not self.index    # A new index after a re-login or history switch lacks the memo's options
+        for p in params:
+            # Every tools.build returns new JSON, so compare parameters by content, which is cheaper than compiling
+            key, fields = p.get('py_name') or p['name'], SpecCompiler.fields(p)
+            entry = self.memo.get(key)
+            unchanged = entry is not None and entry[0] == fields
+            compiled = entry[1] if unchanged else self.param_spec(p)
+            if reseed or not unchanged: index.add_options(compiled[2])
+            memo[key] = (fields, compiled)
+            safe_name, param_spec, _ = compiled
+
+            # Data parameters without options offer the history's datasets of the parameter's kinds
+            if p['type'] == 'data' and 'options' not in p:
+                param_spec = {**param_spec, 'choices': index.choices(param_spec['kinds'])}
+
+            # Data parameter defaults are shown by dataset name, which may change as the history is updated
+            if param_spec['type'] == 'file':
+                default = widget.default_value_name(param_spec['default'], p.get('options'))
+                if default != param_spec['default']: param_spec = {**param_spec, 'default': default}
+            spec[safe_name] = param_spec    # Unchanged parameters share their spec, which is never modified
+        self.memo, self.index = memo, index
+        return spec
+
+    @staticmethod
+    def fields(p):
+        """Return the parameter's values of SPEC_FIELDS, which decide its spec along with the overrides"""
+        return tuple(p.get(k) for k in SPEC_FIELDS)
+
+    def param_spec(self, p):
+        """Create the display spec for a single parameter"""
+        safe_name = p.get('py_name', python_safe(p['name']))
+        overrides = self.overrides.get(safe_name, {})
+        spec = {
+            'name': form_value(overrides.get('name', p['label'] if p.get('label') else p['name'])),
+            'default': form_value(overrides.get('default', value_strings(p.get('value') if p.get('value') is not None else ''))),
+            'description': form_value(overrides.get('description', p['help'] if 'help' in p else '')),
+            'optional': overrides.get('optional', p['optional'] if 'optional' in p else False),
+            'kinds': overrides.get('kinds', p['extensions'] if 'extensions' in p else []),
+            'type': PARAM_TYPES.get(p['type'], 'text'),
+        }
+        datasets = ()
+
+        # Set parameter attributes
+        if p.get('optional'): spec['optional'] = True
+        if p.get('multiple') and spec['type'] != 'file':
+            spec['multiple'] = True
+            spec['maximum'] = 100
+        if p.get('hidden'): spec['hide'] = True
+        if 'extensions' in p: spec['kinds'] = p['extensions']
+        if 'options' in p: spec['choices'], datasets = options_spec(p['options'])
+
+        # Special case for booleans
+        if p['type'] == 'boolean' and 'options' not in p: spec['choices'] = {'Yes': 'True', 'No': 'False'}
+
+        # Special case for multi-value select inputs
+        if spec['type'] == 'choice' and spec.get('multiple'):
+            if isinstance(spec['default'], str): spec['default'] = limited_eval(spec['default'])
+            if spec['default'] is None or spec['default'] == 'None': spec['default'] = []
+
+        # Special case for repeat parameters
+        if p['type'] == 'repeat': spec['default'] = p.get('value', p['default'])
+
+        # Special case for data parameters, whose default is resolved to a dataset name when compiled
+        if spec['type'] == 'file': spec['sendto'] = False
+
+        return safe_name, spec, datasets
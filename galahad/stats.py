@@ -0,0 +1,158 @@
+import json
+import math
+import re
+import time
+from contextlib import ContextDecorator
+from threading import Lock, local
+from urllib.parse import urlsplit
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, math.inf)  # Upper bounds in seconds
+ID_SEGMENT = re.compile(r'^[0-9a-f]{16,}$')     # Galaxy's encoded database IDs
+
+
+class Metric:
+    """Call count, error count, latency histogram and payload sizes for one endpoint or phase"""
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def record(self, seconds, sent=0, received=0, error=False):
+        self.count += 1
+        self.errors += int(error)
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.buckets[next(i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound)] += 1
+        self.bytes_sent += sent
+        self.bytes_received += received
+
+    def percentile(self, fraction):
+        """Estimate a latency percentile as the upper bound of the histogram bucket containing it"""
+        target, seen = fraction * self.count, 0
+        for bound, n in zip(LATENCY_BUCKETS, self.buckets):
+            seen += n
+            if seen >= target: return min(bound, self.max_seconds)
+        return 0.0
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'error_rate': self.errors / self.count if self.count else 0.0,
+            'total_seconds': self.seconds,
+            'mean_seconds': self.seconds / self.count if self.count else 0.0,
+            'p50_seconds': self.percentile(0.5),
+            'p95_seconds': self.percentile(0.95),
+            'max_seconds': self.max_seconds,
+            'histogram': {('inf' if b == math.inf else str(b)): n for b, n in zip(LATENCY_BUCKETS, self.buckets)},
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+        }
+
+
+class StatsReport(dict):
+    """Snapshot of the collected metrics, rendered as tables in the notebook"""
+
+    def json(self, **kwargs):
+        """Return the report serialized as JSON, for export to monitoring"""
+        return json.dumps(self, **kwargs)
+
+    def _repr_html_(self):
+        def table(title, metrics, columns):
+            header = ''.join(f'<th>{c}</th>' for c in ['', *columns])
+            rows = ''.join(f'<tr><td style="text-align: left">{name}</td>' +
+                           ''.join(f'<td>{StatsReport.format(m[c])}</td>' for c in columns) + '</tr>'
+                           for name, m in sorted(metrics.items(), key=lambda i: -i[1]['total_seconds']))
+            return f'<h4>{title}</h4><table><tr>{header}</tr>{rows}</table>'
+
+        return table('Galaxy API calls', self['calls'], ['count', 'errors', 'mean_seconds', 'p95_seconds',
+                                                         'max_seconds', 'bytes_sent', 'bytes_received']) + \
+            table('Local phases', self['phases'], ['count', 'errors', 'mean_seconds', 'p95_seconds', 'max_seconds'])
+
+    @staticmethod
+    def format(value):
+        return f'{value:.3f}' if isinstance(value, float) else str(value)
+
+
+class Stats:
+    """Collects metrics for galahad's calls to the Galaxy API and for its own local processing phases"""
+
+    def __init__(self):
+        self.calls = {}         # Map of 'METHOD /api/endpoint' -> Metric
+        self.phases = {}        # Map of phase name -> Metric
+        self.lock = Lock()
+        self.active = local()   # Phases being timed on each thread, so recursive calls are only counted once
+
+    def record_call(self, method, url, seconds, sent=0, received=0, error=False):
+        name = f'{method.upper()} {Stats.endpoint(url)}'
+        with self.lock: self.calls.setdefault(name, Metric()).record(seconds, sent, received, error)
+
+    def record_phase(self, name, seconds, error=False):
+        with self.lock: self.phases.setdefault(name, Metric()).record(seconds, error=error)
+
+    def timed(self, name):
+        """Return a context manager, also usable as a decorator, which records the time spent in a local phase"""
+        return Phase(self, name)
+
+    def report(self):
+        """Return a snapshot of all metrics collected so far"""
+        from .polling import poll_stats
+        with self.lock:
+            return StatsReport(calls={k: m.summary() for k, m in self.calls.items()},
+                               phases={k: m.summary() for k, m in self.phases.items()},
+                               polling=poll_stats())
+
+    def reset(self):
+        with self.lock:
+            self.calls = {}
+            self.phases = {}
+
+    @staticmethod
+    def endpoint(url):
+        """Return the API path of a url with IDs replaced by placeholders, so that calls are grouped by endpoint"""
+        segments = urlsplit(url).path.split('/')
+        if 'api' in segments: segments = segments[segments.index('api'):]
+        for i, segment in enumerate(segments):
+            if ID_SEGMENT.match(segment): segments[i] = '{id}'
+            elif i and segments[i - 1] == 'tools' and segment not in ('fetch', ''): segments[i] = '{tool_id}'
+        return '/' + '/'.join(segments)
+
+
+class Phase(ContextDecorator):
+    """Times a block of local processing and records it with the Stats"""
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def _recreate_cm(self):
+        return Phase(self.stats, self.name)     # A fresh timer per decorated call, so threads don't share a start time
+
+    def __enter__(self):
+        active = self.stats.active.__dict__.setdefault('names', {})
+        active[self.name] = active.get(self.name, 0) + 1
+        if active[self.name] == 1: self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        active = self.stats.active.names
+        active[self.name] -= 1
+        if active[self.name] == 0: self.stats.record_phase(self.name, time.perf_counter() - self.start, exc is not None)
+        return False
+
+
+"""
+Galahad Stats Singleton
+"""
+metrics = Stats()
+timed = metrics.timed
+
+
+def stats():
+    """Return the metrics collected for Galaxy API calls and local phases, for display in the notebook"""
+    return metrics.report()
@@ -0,0 +1,83 @@
+from threading import Lock
+from bioblend.galaxy.objects.wrappers import HistoryContentInfo
+from nbtools import ToolManager, DataManager
+from .api import content_pages
+from .index import dataset_index
+from .utils import content_data, poll_data_and_update, on_kernel_thread
+
+
+class HistoryPager:
+    """Fetches the contents of a history from Galaxy one page at a time, most recently created first"""
+    page_size = 100
+
+    def __init__(self, gi, history_id, page_size=None):
+        self.gi = gi
+        self.history_id = history_id
+        self.page_size = page_size or self.page_size
+        self.pages = content_pages(gi, history_id, 'create_time', page_size=self.page_size)  # Creation times never change
+        self.exhausted = False
+        self.lock = Lock()
+
+    def next_page(self):
+        """Return the next page of content dicts, or an empty list once every dataset has been fetched"""
+        with self.lock:
+            if self.exhausted: return []
+            page = next(self.pages, [])
+            if len(page) < self.page_size: self.exhausted = True
+            return page
+
+
+class HistorySync:
+    """Applies the changes made to a history since it was last seen to the data panel, rather than reloading it"""
+    page_size = 100
+
+    def __init__(self, gi, origin, history):
+        self.gi = gi
+        self.origin = origin
+        self.history = history
+        self.watermark = None   # Latest update_time among the contents registered so far
+        self.lock = Lock()
+
+    def observe(self, contents):
+        """Advance the watermark past the given content dicts, which the caller has registered"""
+        with self.lock:
+            for content in contents:
+                update_time = content.get('update_time')
+                if update_time and (self.watermark is None or update_time > self.watermark): self.watermark = update_time
+
+    def changes(self):
+        """Return every content dict updated since the watermark, including those which have been deleted"""
+        pages = content_pages(self.gi, self.history.id, 'update_time', descending=False, bound=self.watermark,
+                              page_size=self.page_size, deleted=None)
+        return [content for page in pages for content in page]
+
+    def sync(self):
+        """Query the history's changes since the last sync and apply them on the kernel's thread, return how many"""
+        with self.lock: changed = self.changes()
+        self.observe(changed)
+        dataset_index(self.gi, self.history.id).update(changed)
+        on_kernel_thread(self.apply, changed)
+        return len(changed)
+
+    def apply(self, changed):
+        """Apply changed content dicts to the DataManager, return the number of entries changed"""
+        manager = DataManager.instance()
+        count = 0
+        for content in changed:
+            content = HistoryContentInfo(content, gi=self.gi)
+            existing = manager.get(origin=self.origin, uri=content.id)
+
+            # Remove deleted datasets, add new ones and update the rest in place
+            if content.wrapped.get('deleted') or content.wrapped.get('purged'):
+                if existing is None: continue
+                DataManager.unregister(origin=self.origin, uri=content.id)
+            else:
+                data = content_data(self.origin, self.history.name, content)
+                if existing is None: DataManager.register(data, skip_update=True)
+                elif (existing.label, existing.kind, existing.icon) == (data.label, data.kind, data.icon): continue
+                else: existing.label, existing.kind, existing.icon = data.label, data.kind, data.icon
+                poll_data_and_update(content)
+            count += 1
+
+        if count: ToolManager.instance().send_update()
+        return count
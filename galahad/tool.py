@@ -1,17 +1,24 @@
 import inspect
 import json
 import os
-from copy import deepcopy
+from threading import RLock, get_ident
 from IPython.display import display, HTML
 from bioblend import ConnectionError
 from bioblend.galaxy.objects import Tool, HistoryDatasetAssociation
-from nbtools import NBTool, UIBuilder, UIOutput, python_safe, Data, DataManager, EventManager, ToolManager
-from nbtools.uibuilder import UIBuilderBase
+from nbtools import NBTool, UIBuilder, python_safe, ToolManager, DataManager
 from nbtools.utils import is_url
 
+from .batch import BatchSubmitter, GalaxyBatchWidget, batch_values
+from .catalogue import ToolRecord
 from .dataset import GalaxyDatasetWidget
-from .utils import (GALAXY_LOGO, session_color, galaxy_url, server_name, data_icon, poll_data_and_update,
-                    current_history, limited_eval, data_name, strip_version)
+from .events import subscriptions
+from .expansion import ToolExpansion
+from .forms import build_tool, Debouncer, ReusingBuilder, patchable, patch_widget
+from .index import dataset_index, dataset_indexes
+from .specs import SpecCompiler
+from .stats import timed
+from .uploads import UploadEngine, UploadProgress, register_upload
+from .utils import GALAXY_LOGO, session_color, galaxy_url, current_history, on_kernel_thread
 
 
 class GalaxyToolWidget(UIBuilder):
@@ -21,16 +28,16 @@ class GalaxyToolWidget(UIBuilder):
     function_wrapper = None
     parameter_spec = None
     upload_callback = None
+    expansion = None
+    patching = None         # Thread patching the form, whose widget changes must not trigger refreshes
+    refresher = None
+    spec_compiler = None
     kwargs = {}
 
     def create_function_wrapper(self, all_params):
         """Create a function that accepts the expected input and submits a Galaxy job"""
         if self.tool is None or self.tool.gi is None: return lambda: None  # Dummy function for null task
 
-        # Initialize a mapping of display name to dataset ID and vice versa
-        self.name_to_id = {}
-        self.id_to_name = {}
-
         # Function for submitting a new Galaxy job based on the task form
         def submit_job(**kwargs):
             spec = self.make_job_spec(self.tool, **kwargs)
@@ -60,6 +67,35 @@ class GalaxyToolWidget(UIBuilder):
 
         return submit_job
 
+    def run_batch(self, parameter=None, datasets=None, parameter_sets=None, max_workers=None):
+        """
+        Run the tool many times, reporting the progress of every job in a single widget. Either map the data parameter
+        over a list of datasets in one Galaxy batch request, or submit one job per set of parameter values with bounded
+        concurrency. Parameters which are not given take their values from the form. Batch runs are only available
+        from code, as the form's data inputs take a single dataset and its Run button submits a single job:
+
+            tool_widget.run_batch('input1', datasets=['reads_1.fastq', 'reads_2.fastq'])
+        :param parameter: python name of the data parameter to map over the datasets
+        :param datasets: dataset IDs or display names
+        :param parameter_sets: list of dicts of parameter values, keyed by python name
+        :param max_workers: number of job requests to submit concurrently
+        :return: the batch widget
+        """
+        if self.tool is None or self.tool.gi is None: raise RuntimeError('No Galaxy tool to run')
+        values = self.form_values()
+        if datasets is not None:
+            param = self.param(parameter)
+            if param is None or param['type'] != 'data': raise ValueError(f'{parameter} is not a data parameter of this tool')
+            spec = self.make_job_spec(self.tool, **values)
+            spec[param.get('galaxy_name', param['name'])] = batch_values([self.lookup_id(d) or d for d in datasets])
+            specs = [spec]
+        else: specs = [self.make_job_spec(self.tool, **{**values, **s}) for s in parameter_sets or []]
+
+        widget = GalaxyBatchWidget(self.tool, current_history(self.tool.gi), len(specs))
+        display(widget)
+        BatchSubmitter(self.tool, widget.history, widget, max_workers).submit(specs)
+        return widget
+
     @staticmethod
     def is_excluded(param, kwargs):
         if param.get('conditional_display') is None: return False
@@ -94,139 +130,45 @@ class GalaxyToolWidget(UIBuilder):
 
         return kwargs
 
-    def add_type_spec(self, task_param, param_spec):
-        if   task_param['type'] == 'select':            param_spec['type'] = 'choice'
-        elif task_param['type'] == 'hidden':            param_spec['type'] = 'text'
-        elif task_param['type'] == 'upload_dataset':    param_spec['type'] = 'file'
-        elif task_param['type'] == 'genomebuild':       param_spec['type'] = 'choice'
-        elif task_param['type'] == 'baseurl':           param_spec['type'] = 'text'
-        elif task_param['type'] == 'data':              param_spec['type'] = 'file'
-        elif task_param['type'] == 'text':              param_spec['type'] = 'text'
-        elif task_param['type'] == 'boolean':           param_spec['type'] = 'choice'
-        elif task_param['type'] == 'directory_uri':     param_spec['type'] = 'text'
-        elif task_param['type'] == 'data_collection':   param_spec['type'] = 'file'
-        elif task_param['type'] == 'repeat':            param_spec['type'] = 'number'
-        elif task_param['type'] == 'rules':             param_spec['type'] = 'text'
-        elif task_param['type'] == 'data_column':       param_spec['type'] = 'choice'
-        elif task_param['type'] == 'integer':           param_spec['type'] = 'number'
-        elif task_param['type'] == 'float':             param_spec['type'] = 'number'
-        elif task_param['type'] == 'hidden_data':       param_spec['type'] = 'file'
-        elif task_param['type'] == 'color':             param_spec['type'] = 'color'
-        elif task_param['type'] == 'drill_down':        param_spec['type'] = 'choice'
-        else: param_spec['type'] = 'text'
-
-        # Set parameter attributes
-        if 'optional' in task_param and task_param['optional']: param_spec['optional'] = True
-        if 'multiple' in task_param and task_param['multiple'] and param_spec['type'] != 'file': param_spec['multiple'] = True
-        if 'multiple' in task_param and task_param['multiple'] and param_spec['type'] != 'file': param_spec['maximum'] = 100
-        if 'hidden' in task_param and task_param['hidden']: param_spec['hide'] = True
-        if 'extensions' in task_param: param_spec['kinds'] = task_param['extensions']
-        if 'options' in task_param: param_spec['choices'] = self.options_spec(task_param['options'])
-
-        # Special case for booleans
-        if task_param['type'] == 'boolean' and 'options' not in task_param:
-            param_spec['choices'] = {'Yes': 'True', 'No': 'False'}
-
-        # Special case for multi-value select inputs
-        if param_spec['type'] == 'choice' and param_spec.get('multiple'):
-            if isinstance(param_spec['default'], str): param_spec['default'] = limited_eval(param_spec['default'])
-            if param_spec['default'] is None or param_spec['default'] == 'None': param_spec['default'] = []
-
-        # Special case for repeat parameters
-        if task_param['type'] == 'repeat': param_spec['default'] = task_param.get('value', task_param['default'])
-
-        # Special case for data parameters
-        if param_spec['type'] == 'file':
-            param_spec['default'] = self.default_value_name(param_spec['default'], task_param.get('options'))
-            param_spec['sendto'] = False
-
     def default_value_name(self, id, choices):
         if not choices or not id: return id
         display_name = self.lookup_name(id[0])
         if display_name: return [display_name]
         else: return id
 
-    def options_spec(self, options):
-        if isinstance(options, list): return { c[0]: c[1] for c in options }
-        else:
-            choices = {}
-            for l in options.values():
-                for i in l:
-                    choices[i['name']] = i['name']
-                    self.name_to_id[i['name']] = i['id']
-                    self.id_to_name[i['id']] = i['name']
-            return choices
-
-    @staticmethod
-    def override_if_set(safe_name, attr, param_overrides, param_val):
-        if param_overrides and safe_name in param_overrides and attr in param_overrides[safe_name]:
-            return param_overrides[safe_name][attr]
-        else: return param_val
-
-    @staticmethod
-    def value_strings(raw_values):
-        if isinstance(raw_values, dict):
-            if 'values' in raw_values and isinstance(raw_values['values'], list):
-                if not len(raw_values['values']): return []
-                elif 'id' in raw_values['values'][0]:
-                    return [v['id'] for v in raw_values['values']]
-        return str(raw_values)
-
+    @timed('create_param_spec')
     def create_param_spec(self, kwargs):
         """Create the display spec for each parameter"""
         if self.tool is None or self.tool.gi is None or self.all_params is None: return {}  # Dummy function for null task
-        spec = {}
-        param_overrides = kwargs.get('parameters', None)
-        for p in self.all_params:
-            safe_name = p.get('py_name', python_safe(p['name']))
-            spec[safe_name] = {}
-            spec[safe_name]['name'] = GalaxyToolWidget.form_value(
-                GalaxyToolWidget.override_if_set(safe_name, 'name', param_overrides, p['label'] if p.get('label') else p['name'])
-            )
-            spec[safe_name]['default'] = GalaxyToolWidget.form_value(
-                GalaxyToolWidget.override_if_set(safe_name, 'default', param_overrides,
-                                                 GalaxyToolWidget.value_strings(p.get('value') if p.get('value') is not None else ''))
-            )
-            spec[safe_name]['description'] = GalaxyToolWidget.form_value(
-                GalaxyToolWidget.override_if_set(safe_name, 'description', param_overrides, p['help'] if 'help' in p else '')
-            )
-            spec[safe_name]['optional'] = GalaxyToolWidget.override_if_set(safe_name, 'optional', param_overrides,
-                                                                           p['optional'] if 'optional' in p else False)
-            spec[safe_name]['kinds'] = GalaxyToolWidget.override_if_set(safe_name, 'kinds', param_overrides,
-                                                                        p['extensions'] if 'extensions' in p else [])
-            self.add_type_spec(p, spec[safe_name])
-
-        return spec
+        if self.spec_compiler is None: self.spec_compiler = SpecCompiler(kwargs.get('parameters', None))
+        return self.spec_compiler.compile(self, self.all_params)
 
     @staticmethod
     def generate_upload_callback(session, widget):
         """Create an upload callback to pass to data inputs"""
         def galaxy_upload_callback(values):
             try:
-                for k in values:
-                    # Get the full path in the workspace
-                    path = os.path.realpath(k)
-
-                    # Get the history and upload to that history
-                    history = current_history(session)
-                    dataset = history.upload_dataset(path)
-
-                    # Remove the uploaded file from the workspace
-                    os.remove(path)
-
-                    # Register the uploaded file with the data manager
-                    kind = 'error' if dataset.state == 'error' else (dataset.wrapped['extension'] if 'extension' in dataset.wrapped else '')
-                    data = Data(origin=server_name(galaxy_url(session)), group=history.name, uri=dataset.id,
-                                label=data_name(dataset), kind=kind, icon=data_icon(dataset.state))
-                    def create_dataset_lambda(id): return lambda: GalaxyDatasetWidget(id)
-                    DataManager.instance().data_widget(origin=data.origin, uri=data.uri,
-                                                       widget=create_dataset_lambda(dataset.id))
-                    DataManager.instance().register(data)
-                    poll_data_and_update(dataset)
-
-                    return dataset.id
+                # Get the full paths in the workspace and upload them all to the current history
+                paths = [os.path.realpath(k) for k in values]
+                history = current_history(session)
+                engine = UploadEngine(session, history)
+                datasets = engine.upload(paths)
             except Exception as e:
                 widget.error = f"Error encountered uploading file: {e}"
+                return None
+
+            # Keep the files which failed in the workspace, and report them together once the rest are registered
+            errors = dict(engine.errors)
+            for path, dataset in zip(paths, datasets):
+                if dataset is None: continue
+                try:
+                    os.remove(path)                             # Remove the uploaded file from the workspace
+                    register_upload(session, history, dataset)  # Register the uploaded file with the data manager
+                except Exception as e: errors[path] = e
+            if errors:
+                widget.error = "Error encountered uploading file: " + \
+                    '; '.join(f'{os.path.basename(path)}: {e}' for path, e in errors.items())
+            return next((d.id for d in datasets if d is not None), None)
         return galaxy_upload_callback
 
     def handle_error_task(self, error_message, name='Galaxy Tool', **kwargs):
@@ -239,16 +181,18 @@ class GalaxyToolWidget(UIBuilder):
         self.display_footer = False
         self.error = error_message
 
+    @timed('load_tool_inputs')
     def load_tool_inputs(self):
         if 'inputs' not in self.tool.wrapped:
-            tool_json = self.tool.gi.gi.tools.build(
-                tool_id=self.tool.id, history_id=current_history(self.tool.gi).id, tool_version=self.version)
+            tool_json = build_tool(self.tool.gi, tool_id=self.tool.id, history_id=current_history(self.tool.gi).id,
+                                   tool_version=self.version)
             self.tool = Tool(wrapped=tool_json, parent=self.tool.parent, gi=self.tool.gi)
 
     def __init__(self, tool=None, auto_load=True, origin='', id='', version=None, **kwargs):
         """Initialize the tool widget"""
         self.tool = tool
         self.kwargs = kwargs
+        self.refresh_lock = RLock()
         if tool and origin is None: origin = galaxy_url(tool.gi)
         if tool and id is None: id = tool.id
         self.origin = origin
@@ -288,84 +232,90 @@ class GalaxyToolWidget(UIBuilder):
     def reload_tool(self):
         self.busy = True
         # Update history choices for all data params
-        self.dynamic_update()
+        self.refresh_form()
         self.info = ''
         self.busy = False
 
+    def dataset_index(self):
+        """Return the index of the datasets in the current history, shared with the session's other tool widgets"""
+        return dataset_index(self.tool.gi, current_history(self.tool.gi).id)
+
     def lookup_id(self, display_name):
-        # Attempt to look up id using this tool's data map
-        id = self.name_to_id.get(display_name)
-        if id: return id
+        # Look in the current history's index first, then those of the session's other histories
+        for index in dataset_indexes(self.tool.gi, first=current_history(self.tool.gi).id):
+            id = index.id(display_name)
+            if id: return id
 
-        # If not found, use the DataManager, return None is not there either
+        # If not found, use the DataManager, return None if not there either
         data = DataManager.instance().filter(origin=self.origin, label=display_name)
-        if data: return data.id
+        if data: return data[0].uri
         else: return None
 
     def lookup_name(self, id):
-        # Attempt to look up name using this tool's data map
-        display_name = self.id_to_name.get(id)
-        if display_name: return display_name
+        for index in dataset_indexes(self.tool.gi, first=current_history(self.tool.gi).id):
+            display_name = index.name(id)
+            if display_name: return display_name
 
-        # If not found, use the DataManager, return None is not there either
+        # If not found, use the DataManager, return None if not there either
         data = DataManager.instance().get(origin=self.origin, uri=id)
         if data: return data.label
         else: return None
 
-    def attach_interactive_callbacks(self):
-        def dynamic_update_generator(i):
+    @staticmethod
+    def callback_kind(param):
+        """Return which dynamic refresh callback a parameter's widget needs, None if it needs none"""
+        if param.get('conditional_test'): return 'conditional'
+        if param.get('refresh_on_change', False): return 'dynamic'
+        if param.get('type') == 'repeat': return 'repeat'
+        return None
+
+    def param(self, py_name):
+        """Return the current Galaxy parameter with the given python name, None if it is no longer in the form"""
+        return next((p for p in self.all_params if p['py_name'] == py_name), None)
+
+    def attach_interactive_callbacks(self, widgets=None):
+        """Attach the dynamic refresh callbacks to all of the form's widgets, or only to the given new widgets"""
+        def dynamic_update_generator(key):
             """Dynamic Parameter Callback"""
-            key = self.all_params[i]['py_name']
             def update_form(change):
+                if self.patching == get_ident(): return
                 value = None
                 if not isinstance(change['new'], dict) and (change['new'] or change['new'] == 0): value = change['new']
                 if value:
-                    if self.all_params[i]['type'] == 'data':
+                    if self.param(key)['type'] == 'data':
                         if not is_url(value) and not self.lookup_id(value) and not self.lookup_name(value): return
-                    try: self.dynamic_update({key: value})
-                    except ConnectionError as e:
-                        self.error = e.body
-                        self.busy = False
+                    self.dynamic_update({key: value})
             return update_form
 
-        def conditional_update_generator(i):
+        def conditional_update_generator(conditional_name):
             """Conditional Parameter Callback"""
-            conditional_name = self.all_params[i]['py_name']
             def conditional_form(change):
+                if self.patching == get_ident(): return
                 if change['name'] == 'value' and not isinstance(change['new'], dict) and (change['new'] or change['new'] == 0):
                     self.dynamic_update({ conditional_name: change['new'] }, query_galaxy=False)
             return conditional_form
 
-        def repeat_update_generator(i):
+        def repeat_update_generator(repeat_param_name):
             """Repeat Parameter Callback"""
-            repeat_param_name = self.all_params[i]['py_name']
             def repeat_form(change):
+                if self.patching == get_ident(): return
                 if not isinstance(change['new'], dict):
                     section_count = change['new']
-                    self.all_params[i]['value'] = section_count
+                    self.param(repeat_param_name)['value'] = section_count
                     self.dynamic_update({repeat_param_name: section_count})
             return repeat_form
 
         # Handle callbacks for data parameters
-        EventManager.instance().register("galaxy.history_refresh", self.history_callback)
+        if widgets is None: subscriptions.subscribe("galaxy.history_refresh", self.history_callback)
 
         # Handle callbacks for complex parameter types
-        for i in range(len(self.all_params)):
-
-            # Handle conditional parameters
-            if self.all_params[i].get('conditional_test'):
-                self.form.form.kwargs_widgets[i].input.observe(conditional_update_generator(i))
-                continue
-
-            # Handle dynamic parameters
-            if self.all_params[i].get('refresh_on_change', False):
-                self.form.form.kwargs_widgets[i].input.observe(dynamic_update_generator(i))
-                continue
-
-            # Handle repeat parameters
-            if self.all_params[i].get('type') == 'repeat':
-                self.form.form.kwargs_widgets[i].input.observe(repeat_update_generator(i))
-                continue
+        generators = {'conditional': conditional_update_generator, 'dynamic': dynamic_update_generator,
+                      'repeat': repeat_update_generator}
+        new_widgets = None if widgets is None else {id(w) for w in widgets}
+        for param, widget in zip(self.all_params, self.form.form.kwargs_widgets):
+            kind = GalaxyToolWidget.callback_kind(param)
+            if kind is None or (new_widgets is not None and id(widget) not in new_widgets): continue
+            widget.input.observe(generators[kind](param['py_name']))
 
     def valid_value(self, name, value):
         values = self.parameter_spec[name].get('choices', {}).values()
@@ -386,153 +336,123 @@ class GalaxyToolWidget(UIBuilder):
         }
         return {**ui_args, **kwargs, 'parameters': self.parameter_spec}
 
-    def expand_sections(self, input=None):
+    @timed('expand_sections')
+    def expand_sections(self):
+        """Return the tool's parameter groups and flat parameter list, reusing the expansion while the JSON is unchanged"""
         # Ensure everything is in the expected format
         if not self.tool or not self.tool.wrapped or 'inputs' not in self.tool.wrapped: return [], []
-        if input is None:
-            top_level = True
-            input = self.tool.wrapped
-        else: top_level = False
-        if not input.get('inputs'): input['inputs'] = []
-
-        # Assemble the group object and empty parameters
-        group = {
-            'name': input.get('label', input.get('title', input.get('name', ''))),
-            'description': input.get('description', ''),
-            'hidden': not input.get('expanded', True),
-            'parameters': []
-        }
-        all_params = []
-
-        for p in input.get('inputs'):
-            if p['type'] == 'section':
-                p['galaxy_name'] = f"{p['name']}" if top_level or not input.get('galaxy_name') else f"{input['galaxy_name']}|{p['name']}"
-                p['py_name'] = python_safe(p['galaxy_name'])
-
-                section_group, section_params = self.expand_sections(p)
-                group['parameters'].append(section_group)       # Add param to group structure
-                all_params.extend(section_params)               # Add param to the flat list
-
-            elif p['type'] == 'conditional':
-                # Add galaxy and python names to conditional (used in full path names)
-                p['galaxy_name'] = f"{p['name']}" if top_level or not input.get('galaxy_name') else f"{input['galaxy_name']}|{p['name']}"
-                p['py_name'] = python_safe(p['galaxy_name'])
-
-                # Base group object - conditional_params will always be blank at this point
-                conditional_group, conditional_params = self.expand_sections(p)
-
-                # Rename the group based on the test parameter's name - conditional params never have a nice label
-                conditional_group['name'] = p['test_param'].get('label', p['test_param'].get('title', p['test_param'].get('name', '')))
-                if not conditional_group['name']: conditional_group['name'] = p['test_param'].get('name', 'Select')
-
-                # Add the test param and add conditional_test flag
-                p['test_param']['galaxy_name'] = f"{p['name']}|{p['test_param']['name']}" if top_level else f"{p['galaxy_name']}|{p['test_param']['name']}"
-                p['test_param']['py_name'] = python_safe(p['test_param']['galaxy_name'])
-                p['test_param']['conditional_test'] = True
-                conditional_group['parameters'].append(p['test_param'].get('py_name', p['test_param']['name']))
-                conditional_params.append(p['test_param'])
-
-                # If the test param value is overridden, set new value
-                if hasattr(self, 'initial_spec'):
-                    if p['test_param']['py_name'] in self.initial_spec:
-                        p['test_param']['value'] = self.initial_spec[p['test_param']['py_name']]
-
-                # Add the case params
-                for case in p['cases']:
-                    case['galaxy_name'] = p['galaxy_name']
-                    case['py_name'] = p['py_name']
-
-                    if case['value'] == p['test_param']['value']:
-                        for cp in case['inputs']:
-                            cp['galaxy_name'] = f"{p['name']}|{cp['name']}" if top_level else f"{p['galaxy_name']}|{cp['name']}"
-                            cp['py_name'] = python_safe(cp['galaxy_name'] + '_' + case['value'])
-                            cp['conditional_display'] = case['value']           # Save display/submit conditions
-                            cp['conditional_param'] = p['test_param']['name']   # Save name of test param
-                            cp['hidden'] = False if case['value'] == p['test_param']['value'] else True
-                        case_group, case_params = self.expand_sections(case)
-                        conditional_group['parameters'].extend(case_group['parameters'])
-                        conditional_params.extend(case_params)
-
-                group['parameters'].append(conditional_group)   # Add param to group structure
-                all_params.extend(conditional_params)           # Add param to the flat list
-            elif p['type'] == 'repeat':
-                # Add number parameter for repeat sections
-                if 'title' in p and 'label' not in p: p['label'] = f"Number of {p['title']}"
-                p['galaxy_name'] = f"{p['name']}" if top_level or not input.get('galaxy_name') else f"{input['galaxy_name']}|{p['name']}"
-                p['py_name'] = python_safe(p['galaxy_name'])
-                group['parameters'].append(p.get('py_name', p['name']))
-                all_params.append(p)
-                if 'inputs' not in p: continue
-
-                # Merge repeat values, if overridden
-                if hasattr(self, 'initial_spec'):
-                    if p['py_name'] in self.initial_spec: p['value'] = int(self.initial_spec[p['py_name']])
-
-                # Add group N times, where N is the number of repeats
-                for i in range(p.get('value', p['default'])):
-                    p_repeat = deepcopy(p)
-                    if 'cache' in p and len(p['cache']) > i: p_repeat['inputs'] = p['cache'][i]  # If cache, copy inputs
-                    p_repeat['galaxy_name'] = f"{p['name']}_{i}" if top_level or not input.get('galaxy_name') else f"{input['galaxy_name']}|{p['name']}_{i}"
-                    p_repeat['py_name'] = python_safe(p['galaxy_name'])
-                    for rp in p_repeat['inputs']:
-                        rp['galaxy_name'] = f"{p['name']}_{i}|{rp['name']}" if top_level else f"{p['galaxy_name']}_{i}|{rp['name']}"
-                        rp['py_name'] = python_safe(rp['galaxy_name'])
-                    repeat_group, repeat_params = self.expand_sections(p_repeat)
-
-                    group['parameters'].append(repeat_group)            # Add param to group structure
-                    all_params.extend(repeat_params)                    # Add param to the flat list
-
-            else:
-                if not p.get('galaxy_name'):
-                    p['galaxy_name'] = f"{p['name']}" if top_level else \
-                        (f"{input['galaxy_name']}|{p['name']}" if input.get('galaxy_name') else f"{p['name']}")
-                if not p.get('py_name'): p['py_name'] = python_safe(p['galaxy_name'])
-                group['parameters'].append(p.get('py_name', p['name']))     # Add param name to group structure
-                all_params.append(p)                                        # Add param to the flat list
-
-        return group['parameters'] if top_level else group, all_params
+        if self.expansion is None or self.expansion.tool_json is not self.tool.wrapped:
+            self.expansion = ToolExpansion(self.tool.wrapped)
+        return self.expansion.expand(getattr(self, 'initial_spec', None))
 
     def dynamic_update(self, overrides={}, query_galaxy=True):
+        """Request a refresh of the form, coalesced with any others requested in quick succession"""
         self.form.busy = True
-
-        # Get the form's current values
+        if self.refresher is None: self.refresher = Debouncer(self.background_refresh)
+        self.refresher.request(overrides, query_galaxy)
+
+    def background_refresh(self, overrides, query_galaxy, generation):
+        """Query Galaxy on the debouncer's thread, so the kernel stays responsive, then update the form on the kernel's"""
+        try: refresh = self.prepare_refresh(overrides, query_galaxy)
+        except Exception as e: return on_kernel_thread(self.finish_refresh, None, generation, e)
+        on_kernel_thread(self.finish_refresh, refresh, generation)
+
+    def refresh_form(self, overrides={}, query_galaxy=True):
+        """Rebuild the form from its current values"""
+        self.apply_prepared(self.prepare_refresh(overrides, query_galaxy))
+
+    @timed('dynamic_update')
+    def prepare_refresh(self, overrides, query_galaxy):
+        """Return the overrides, the form's current values and the tool model updated for them"""
+        with self.refresh_lock:
+            # Get the form's current values
+            initial_spec = {**self.form_values(), **overrides}
+
+            # Put the dataset values in the expected format
+            spec = self.make_job_spec(self.tool, **initial_spec)
+
+        # Query the updated Galaxy Tool model, without holding the lock
+        tool = self.tool
+        if query_galaxy:
+            tool_json = build_tool(self.tool.gi, tool_id=self.tool.id, history_id=current_history(self.tool.gi).id, inputs=spec)
+            tool = Tool(wrapped=tool_json, parent=self.tool.parent, gi=self.tool.gi)
+        return overrides, initial_spec, tool
+
+    def finish_refresh(self, refresh, generation, error=None):
+        """Apply a background refresh unless a newer one has been requested, or display its error"""
+        try:
+            if error is not None: raise error
+            if self.refresher.is_stale(generation): return   # Superseded, the newer refresh applies
+            self.apply_prepared(refresh)
+        except ConnectionError as e: self.error = getattr(e, 'body', None) or str(e)
+        except Exception as e: self.error = f'Error refreshing Galaxy tool: {e}'
+        finally:
+            self.refresher.done(generation)
+            if not self.refresher.is_stale(generation): self.form.busy = False
+
+    def apply_prepared(self, refresh):
+        with self.refresh_lock:
+            self.overrides, self.initial_spec, self.tool = refresh
+            self.apply_refresh()
+
+    def form_values(self):
+        """Return the form's current values, keyed by python parameter name"""
         values = [p.get_interact_value() for p in self.form.form.kwargs_widgets]
         keys = [p['py_name'] for p in self.all_params]
-        initial_spec = {keys[i]: values[i] for i in range(len(keys))}
-        initial_spec = {**initial_spec, **overrides}
-
-        self.overrides = overrides
-        self.initial_spec = initial_spec
-
-        # Put the dataset values in the expected format
-        spec = self.make_job_spec(self.tool, **initial_spec)
-
-        # Update the Galaxy Tool model
-        if query_galaxy:
-            tool_json = self.tool.gi.gi.tools.build(tool_id=self.tool.id, history_id=current_history(self.tool.gi).id, inputs=spec)
-            self.tool = Tool(wrapped=tool_json, parent=self.tool.parent, gi=self.tool.gi)
+        return {keys[i]: values[i] for i in range(len(keys))}
 
+    def apply_refresh(self):
+        """Recompile the parameters from the tool model and bring the displayed form up to date"""
         # Build the new function wrapper
+        old_params, old_spec, old_groups = self.all_params, self.parameter_spec, self.parameter_groups
         self.parameter_groups, self.all_params = self.expand_sections()         # List groups and compile all params
         self.function_wrapper = self.create_function_wrapper(self.all_params)   # Build the function wrapper
         self.parameter_spec = self.create_param_spec(self.kwargs)               # Create the parameter spec
         self.ui_args = self.create_ui_args(self.kwargs)                         # Merge kwargs (allows overrides)
 
+        # Update the displayed form in place if only parameter specs changed, otherwise replace it
+        if not self.patch_form(old_params, old_spec, old_groups): self.rebuild_form(old_params, old_spec)
+        if not self.refresher or self.refresher.pending is None: self.form.busy = False
+
+    def patch_form(self, old_params, old_spec, old_groups):
+        """Apply the new parameter spec to the form's existing widgets, return False if the form must be rebuilt"""
+        kinds = lambda params: [(p['py_name'], GalaxyToolWidget.callback_kind(p)) for p in params]
+        if kinds(old_params) != kinds(self.all_params) or old_groups != self.parameter_groups: return False
+
+        # Check every changed widget can be updated in place before touching any of them
+        widgets = self.form.form.kwargs_widgets
+        changed = [i for i, p in enumerate(self.all_params) if old_spec[p['py_name']] != self.parameter_spec[p['py_name']]]
+        if not all(patchable(widgets[i], old_spec[self.all_params[i]['py_name']],
+                             self.parameter_spec[self.all_params[i]['py_name']]) for i in changed): return False
+
+        # Point the form at the new function wrapper and update the changed widgets, without triggering refreshes
+        form_specs = self.form._param_customs(self.form._param_defaults(inspect.signature(self.function_wrapper)),
+                                              self.parameter_spec)
+        self.form.function_or_method = self.function_wrapper
+        self.form.form.f = self.function_wrapper
+        self.form._parameters = form_specs
+        self.patching = get_ident()
+        try:
+            for i in changed: patch_widget(widgets[i], form_specs[i])
+        finally: self.patching = None
+        return True
+
+    def rebuild_form(self, old_params, old_spec):
+        """Replace the form with a new one, reusing the widgets of parameters whose spec and callbacks are unchanged"""
+        new_kinds = {p['py_name']: GalaxyToolWidget.callback_kind(p) for p in self.all_params}
+        reuse = {p['py_name']: widget for p, widget in zip(old_params, self.form.form.kwargs_widgets)
+                 if p['py_name'] in new_kinds and new_kinds[p['py_name']] == GalaxyToolWidget.callback_kind(p)
+                 and old_spec[p['py_name']] == self.parameter_spec[p['py_name']]}
+
         # Insert the newly generated widgets into the display
-        self.form = UIBuilderBase(self.function_wrapper, _parent=self, **self.ui_args)
+        self.form = ReusingBuilder(self.function_wrapper, reuse=reuse, _parent=self, **self.ui_args)
         self.output = self.form.output
         self.children = [self.form, self.output]
         self.attach_menu_items()
 
-        # Attach the dynamic refresh callbacks to the new form
-        self.attach_interactive_callbacks()
-        self.form.busy = False
-
-    @staticmethod
-    def form_value(raw_value):
-        """Give the default parameter value in format the UI Builder expects"""
-        if raw_value is not None: return raw_value
-        else: return ''
+        # Attach the dynamic refresh callbacks to the widgets which are new
+        reused = {id(w) for w in reuse.values()}
+        self.attach_interactive_callbacks([w for w in self.form.form.kwargs_widgets if id(w) not in reused])
 
     def attach_menu_items(self):
         self.extra_menu_items = {
@@ -552,15 +472,20 @@ class GalaxyToolWidget(UIBuilder):
 
 
 class GalaxyTool(NBTool):
-    """Tool wrapper for Galaxy tools"""
+    """Tool wrapper for Galaxy tools, registered with only the fields the tool browser shows"""
 
     def __init__(self, server_name, tool):
         NBTool.__init__(self)
+        self.record = tool if isinstance(tool, ToolRecord) else ToolRecord(tool)
         self.origin = server_name
-        self.id = strip_version(tool.id)
-        self.name = tool.name
-        self.description = tool.wrapped['description']
-        self.load = lambda **kwargs: GalaxyToolWidget(tool, id=self.id, origin=self.origin, **kwargs)
+        self.id = self.record.base_id
+        self.name = self.record.name
+        self.description = self.record.description
+        self.tags = [self.record.section] if self.record.section else None
+
+    def load(self, **kwargs):
+        """Resolve the Galaxy tool and return its widget, which fetches the tool's inputs"""
+        return GalaxyToolWidget(self.record.tool(), id=self.id, origin=self.origin, **kwargs)
 
 
 class GalaxyUploadTool(NBTool):
@@ -569,6 +494,7 @@ class GalaxyUploadTool(NBTool):
     class GalaxyUploadWidget(UIBuilder):
         def __init__(self, tool, session, **kwargs):
             self.session = session
+            self.staged = set()     # Paths of the browser uploads waiting in the workspace
             ui_args = {
                 'color': session_color(galaxy_url(session)),
                 'id': tool.id,
@@ -578,31 +504,39 @@ class GalaxyUploadTool(NBTool):
                 'description': tool.description,
                 'parameters': {'datasets': {'type': 'file', 'description': 'Select a file to upload to the Galaxy server',
                                             'multiple': True, 'maximum': 10}},
-                'upload_callback': GalaxyToolWidget.generate_upload_callback(session, self),
+                'upload_callback': self.staging_callback,
                 **kwargs
             }
             UIBuilder.__init__(self, self.create_function_wrapper(), **ui_args)
 
+        def staging_callback(self, values):
+            """Keep files uploaded from the browser in the workspace, so that they can all be sent at once on submit"""
+            for k in values:
+                path = os.path.realpath(k)
+                self.staged.add(path)
+                return path
+
         def create_function_wrapper(self):
             def upload_data(datasets):
                 if type(datasets) == str: datasets = [datasets]
-                count = 1
-                for dataset in datasets:
-                    # Display uploading... placeholder
-                    placeholder = UIOutput(name='Uploading...', info=f'Uploading file {count} of {len(datasets)}...',
-                                           logo='none', color=session_color(galaxy_url(self.session), secondary_color=True))
-                    display(placeholder)
-
-                    # Upload the dataset
-                    history = current_history(self.session)
-                    dataset_json = self.session.gi.tools.put_url(content=dataset, history_id=history.id)
+                history = current_history(self.session)
+                paths = [d for d in datasets if os.path.isfile(d)]
+                urls = [d for d in datasets if not os.path.isfile(d)]
+
+                # Upload the files concurrently, showing their combined progress in a single widget
+                progress = UploadProgress(self.session)
+                display(progress)
+                for path, dataset in zip(paths, UploadEngine(self.session, history, progress).upload(paths)):
+                    if dataset is None: continue
+                    if path in self.staged: os.remove(path)     # Remove the uploaded file from the workspace
+                    register_upload(self.session, history, dataset)
+
+                # Have Galaxy fetch the URLs
+                for url in urls:
+                    dataset_json = self.session.gi.tools.put_url(content=url, history_id=history.id)
                     dataset = HistoryDatasetAssociation(ds_dict=dataset_json['outputs'][0], container=history, gi=self.session)
-
-                    # Display a dataset widget
                     display(GalaxyDatasetWidget(dataset, logo='none', color=session_color(galaxy_url(self.session), secondary_color=True)))
-                    placeholder.close()
-                    display(HTML('&nbsp;'))
-                    count += 1
+                display(HTML('&nbsp;'))
             return upload_data
 
     def __init__(self, server_name, session):
@@ -633,7 +567,7 @@ def load_tool(sessions, id, session_index='https://usegalaxy.org', version=None)
             placeholder.clear_output()
             with placeholder: display(display_tool(data, version, auto_load=False))
 
-        EventManager.instance().register("galaxy.login", login_callback)
+        subscriptions.subscribe("galaxy.login", login_callback, widget=placeholder)
         return placeholder
 
     else: return display_tool(session, version)
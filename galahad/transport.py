@@ -0,0 +1,108 @@
+import json
+import time
+from threading import Lock
+import requests
+from bioblend import ConnectionError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from .stats import metrics
+
+REQUEST_METHODS = ('make_get_request', 'make_post_request', 'make_put_request', 'make_patch_request',
+                   'make_delete_request')
+
+
+class GalaxyTransport:
+    """A pooled keep-alive HTTP session through which all API requests for one Galaxy session are sent"""
+    pool_size = 16                      # Connections kept open per host, enough for the poller, login and transfers
+    retries = 3                         # Attempts after the first for idempotent requests that fail
+    backoff_factor = 0.5                # Retries wait 0.5s, 1s, 2s...
+    retry_statuses = (429, 502, 503, 504)
+    timeout = (10, 300)                 # Seconds to connect and to wait between bytes, if bioblend sets no timeout
+
+    def __init__(self, client):
+        self.client = client            # The bioblend GalaxyInstance, not the objects one
+        self.http = requests.Session()
+        retry = Retry(total=self.retries, backoff_factor=self.backoff_factor, status_forcelist=self.retry_statuses,
+                      allowed_methods=frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS']), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size, max_retries=retry)
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+
+    def attach(self):
+        """Route the bioblend client's requests through this transport"""
+        self.originals = {m: getattr(self.client, m) for m in REQUEST_METHODS}
+        self.client.make_get_request = self.get
+        self.client.make_post_request = self.post
+        self.client.make_put_request = lambda url, payload=None, params=None: self.send('put', url, payload, params)
+        self.client.make_patch_request = lambda url, payload=None, params=None: self.send('patch', url, payload, params)
+        self.client.make_delete_request = self.delete
+
+    def detach(self):
+        """Restore bioblend's own request methods and close the pooled connections"""
+        for m in REQUEST_METHODS: self.client.__dict__.pop(m, None)
+        self.http.close()
+
+    def options(self, kwargs):
+        """Apply the client's headers, TLS verification and timeout to a request's keyword arguments"""
+        kwargs.setdefault('headers', self.client.json_headers)
+        kwargs.setdefault('timeout', self.client.timeout or self.timeout)
+        kwargs.setdefault('verify', self.client.verify)
+        return kwargs
+
+    def request(self, method, url, **kwargs):
+        """Send a request through the pool and record its latency, payload sizes and outcome"""
+        start = time.perf_counter()
+        try: r = self.http.request(method, url, **self.options(kwargs))
+        except Exception:
+            metrics.record_call(method, url, time.perf_counter() - start, len(kwargs.get('data') or ''), error=True)
+            raise
+        received = len(r.content) if not kwargs.get('stream') else int(r.headers.get('Content-Length') or 0)
+        metrics.record_call(method, url, time.perf_counter() - start, len(kwargs.get('data') or ''), received,
+                            error=r.status_code >= 400)
+        return r
+
+    def get(self, url, **kwargs):
+        """Pooled replacement for GalaxyClient.make_get_request, returns the response"""
+        return self.request('get', url, **kwargs)
+
+    def post(self, url, payload=None, params=None, files_attached=False):
+        """Pooled replacement for GalaxyClient.make_post_request, returns the decoded response"""
+        if files_attached:
+            with metrics.timed('multipart_upload'):
+                return self.originals['make_post_request'](url, payload, params, files_attached)
+        return self.send('post', url, payload, params)
+
+    def delete(self, url, payload=None, params=None):
+        """Pooled replacement for GalaxyClient.make_delete_request, returns the response"""
+        data = json.dumps(payload) if payload is not None else None
+        return self.request('delete', url, params=params, data=data, allow_redirects=False)
+
+    def send(self, method, url, payload=None, params=None):
+        """Send a JSON request and decode the response, raising errors the same way as bioblend"""
+        data = json.dumps(payload) if payload is not None else None
+        r = self.request(method, url, params=params, data=data, allow_redirects=False)
+        if r.status_code == 200:
+            try: return r.json()
+            except Exception as e:
+                raise ConnectionError(f'Request was successful, but cannot decode the response content: {e}',
+                                      body=r.content, status_code=r.status_code)
+        raise ConnectionError(f'Unexpected HTTP status code: {r.status_code}', body=r.text, status_code=r.status_code)
+
+
+_transports = {}        # Map of session -> GalaxyTransport
+_transports_lock = Lock()
+
+
+def attach_transport(gi):
+    """Route all of a Galaxy session's requests through a pooled transport, return the transport"""
+    with _transports_lock:
+        if gi not in _transports:
+            _transports[gi] = GalaxyTransport(gi.gi)
+            _transports[gi].attach()
+        return _transports[gi]
+
+
+def detach_transport(gi):
+    """Stop routing a Galaxy session's requests through its pooled transport, if it has one"""
+    with _transports_lock: transport = _transports.pop(gi, None)
+    if transport: transport.detach()
@@ -0,0 +1,186 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from time import monotonic
+from bioblend.galaxy.objects.wrappers import HistoryDatasetAssociation
+from nbtools import UIOutput, DataManager
+from tinydb import TinyDB
+from tusclient.client import TusClient
+from tusclient.exceptions import TusCommunicationError
+from tusclient.fingerprint.interface import Fingerprint
+from tusclient.storage.interface import Storage
+from .catalogue import parse_version
+from .dataset import GalaxyDatasetWidget
+from .index import dataset_index
+from .utils import (session_color, galaxy_url, server_name, content_data, poll_data_and_update, data_name, cache_dir,
+                    format_bytes)
+
+
+class PathFingerprint(Fingerprint):
+    """Identifies a resumable upload by file path, size and modification time, without hashing its contents"""
+
+    def get_fingerprint(self, fs):
+        stat = os.fstat(fs.fileno())
+        return f'{os.path.realpath(fs.name)}:{stat.st_size}:{stat.st_mtime_ns}'
+
+    @staticmethod
+    def of(path):
+        with open(path, 'rb') as stream: return PathFingerprint().get_fingerprint(stream)
+
+
+class UploadStorage(Storage):
+    """Thread-safe file store of the TUS URLs of unfinished uploads, so that an interrupted upload can be resumed"""
+
+    def __init__(self, path):
+        self.path = path
+        self.db = None      # Opened on first use, the TinyDB file is shared by every upload
+        self.lock = Lock()
+
+    def table(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.db = TinyDB(self.path)
+        return self.db
+
+    def get_item(self, key):
+        with self.lock:
+            result = self.table().get(lambda item: item.get('key') == key)
+            return result.get('url') if result else None
+
+    def set_item(self, key, url):
+        with self.lock:
+            self.table().upsert({'key': key, 'url': url}, lambda item: item.get('key') == key)
+
+    def remove_item(self, key):
+        with self.lock: self.table().remove(lambda item: item.get('key') == key)
+
+
+"""
+Resumable Upload Storage Singleton
+"""
+upload_storage = UploadStorage(os.path.join(cache_dir(), 'uploads.json'))
+
+_tus_support = {}   # Map of Galaxy API URL -> whether the server has the TUS upload endpoint
+
+
+def supports_tus(session):
+    """Return whether the server accepts resumable uploads, which Galaxy has since 22.01"""
+    url = session.gi.url
+    if url not in _tus_support:
+        release = parse_version(session.gi.config.get_version().get('version_major'))
+        _tus_support[url] = release is not None and release >= parse_version('22.01')
+    return _tus_support[url]
+
+
+def register_upload(session, history, dataset):
+    """Register an uploaded dataset with the data panel, and keep its icon up to date until it is ready"""
+    data = content_data(server_name(galaxy_url(session)), history.name, dataset)
+    def create_dataset_lambda(id): return lambda: GalaxyDatasetWidget(id)
+    DataManager.instance().data_widget(origin=data.origin, uri=data.uri, widget=create_dataset_lambda(dataset.id))
+    DataManager.instance().register(data)
+    dataset_index(session, history.id).update([dataset.wrapped])
+    poll_data_and_update(dataset)
+
+
+class UploadEngine:
+    """Uploads files to a Galaxy history concurrently, streaming each from disk in resumable chunks"""
+    max_workers = 4                     # Concurrent uploads
+    chunk_size = 10 * 1024 * 1024       # Bytes sent per TUS request, the most held in memory by each upload
+
+    def __init__(self, session, history, progress=None, max_workers=None, chunk_size=None):
+        self.session = session
+        self.history = history
+        self.progress = progress        # UploadProgress widget to report to, if any
+        self.max_workers = max_workers or self.max_workers
+        self.chunk_size = chunk_size or self.chunk_size
+        self.errors = {}                # Map of path -> exception, for each upload which failed
+
+    def upload(self, paths):
+        """Upload the files, return a dataset wrapper for each in order, None for any which failed"""
+        if self.progress: self.progress.add_files(paths)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='galahad-upload') as executor:
+            return list(executor.map(self.upload_one, paths))
+
+    def upload_one(self, path):
+        try:
+            dataset = self.upload_file(path) if supports_tus(self.session) else self.history.upload_dataset(path)
+            if self.progress: self.progress.finished(path, dataset)
+            return dataset
+        except Exception as e:
+            self.errors[path] = e
+            if self.progress: self.progress.failed(path, e)
+
+    def upload_file(self, path):
+        """Send the file to the TUS endpoint chunk by chunk, resuming any earlier attempt, then add it to the history"""
+        gi = self.session.gi
+        client = TusClient(gi.url + '/upload/resumable_upload', headers={'x-api-key': gi.key})
+        def create_uploader(): return client.uploader(file_path=path, chunk_size=self.chunk_size, store_url=True,
+                                                      url_storage=upload_storage, fingerprinter=PathFingerprint())
+        try: uploader = create_uploader()
+        except TusCommunicationError:   # The server has discarded the earlier attempt, so start over
+            upload_storage.remove_item(PathFingerprint.of(path))
+            uploader = create_uploader()
+
+        size = uploader.get_file_size()
+        while True:
+            uploader.upload_chunk()     # Reads one chunk from disk, and creates the upload on the first call
+            if self.progress: self.progress.update(path, uploader.offset)
+            if uploader.offset >= size: break
+        upload_storage.remove_item(PathFingerprint.of(path))
+
+        response = gi.tools.post_to_fetch(path, self.history.id, uploader.session_id)
+        return HistoryDatasetAssociation(response['outputs'][0], container=self.history, gi=self.session)
+
+
+class UploadProgress(UIOutput):
+    """A single widget showing the combined byte-level progress of a set of uploads"""
+    interval = 0.25     # Minimum seconds between progress renders, the final state is always rendered
+
+    def __init__(self, session, **kwargs):
+        self.session = session
+        self.sizes = {}         # Map of path -> file size in bytes
+        self.sent = {}          # Map of path -> bytes acknowledged by the server
+        self.datasets = []
+        self.errors = []
+        self.rendered = 0
+        self.lock = Lock()
+        kwargs = {'name': 'Uploading...', 'origin': server_name(galaxy_url(session)), 'logo': 'none',
+                  'color': session_color(galaxy_url(session), secondary_color=True), **kwargs}
+        UIOutput.__init__(self, default_file_menu_items=False, attach_file_prefixes=False, **kwargs)
+
+    def add_files(self, paths):
+        with self.lock:
+            for path in paths:
+                self.sizes[path] = os.path.getsize(path)
+                self.sent[path] = 0
+        self.render(force=True)
+
+    def update(self, path, sent):
+        with self.lock: self.sent[path] = sent
+        self.render()
+
+    def finished(self, path, dataset):
+        with self.lock:
+            self.sent[path] = self.sizes[path]
+            self.datasets.append(dataset)
+        self.render(force=True)
+
+    def failed(self, path, error):
+        with self.lock: self.errors.append(f'{os.path.basename(path)}: {error}')
+        self.render(force=True)
+
+    def render(self, force=False):
+        """Summarize the uploads in the widget, at most once per interval unless forced"""
+        with self.lock:
+            if not force and monotonic() - self.rendered < self.interval: return
+            self.rendered = monotonic()
+            total, sent = sum(self.sizes.values()), sum(self.sent.values())
+            datasets, errors = list(self.datasets), list(self.errors)
+        done = len(datasets) + len(errors) == len(self.sizes)
+
+        self.name = 'Upload Complete' if done else 'Uploading...'
+        self.status = f'{len(datasets)} of {len(self.sizes)} files uploaded' + (f', {len(errors)} failed' if errors else '')
+        self.description = f'{format_bytes(sent)} of {format_bytes(total)}' + \
+            (f' ({sent * 100 // total}%)' if total else '')
+        self.files = [(d.id, data_name(d), d.wrapped.get('extension', '')) for d in datasets]
+        self.text = '\n'.join(errors)
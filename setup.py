@@ -37,6 +37,8 @@ setup(name='galaxy-galahad',
           'jupyterlab>=3.6,<4',
           'ipywidgets>=8.0.0',
           'pandas',
+          'tuspy',
+          'tinydb',
       ],
       data_files=[("share/jupyter/nbtools", ["nbtools/galahad.json"])],
       normalize_version=False,